@@ -1,182 +1,700 @@
 import dash  
 from dash import dcc, html, Input, Output, State, dash_table  
 import pandas as pd  
-import io, base64  
-import dash_bootstrap_components as dbc  
-from openpyxl import Workbook, load_workbook  
-from openpyxl.styles import PatternFill, Font  
-from itertools import combinations, permutations
+import numpy as np
+import contextlib, functools, json, logging, os, re, tempfile, time, uuid  
+import diskcache
+import flask
 from dotenv import load_dotenv  
+from pipeline import (
+    CACHES, COMPARE_FILLS, EXCEL_MAX_ROWS, MAX_EXCEL_PAIRS, PAIRS_FORMATS, SIMILARITY_METRICS, UPLOAD_DIR, UPLOAD_EXTENSIONS,
+    CallbackTimer, LRUCache, _callback_timer, build_table, compare_column_names, count, estimate_pair_count,
+    estimate_pairs_output, export_table, format_bytes, frame_nbytes, get_table, get_upload,
+    pair_blocks, phase, pick_id_column, plan_pairs, prune_dir, result_key, row_token_lists, save_upload,
+    upload_columns, upload_path, upload_preview, write_pairs,
+)
   
 # Load environment variables  
 load_dotenv()  
+
+# Sorted/filtered row orders of recently viewed tables, so paging is a slice
+_view_cache = LRUCache(32, sizeof=lambda rows: 1)
+
+def split_filter_query(query):
+    # Split on && outside quoted values
+    terms, current, quote, i = [], [], None, 0
+    while i < len(query):
+        ch = query[i]
+        if quote:
+            if ch == '\\' and i + 1 < len(query):
+                current.append(query[i:i + 2])
+                i += 2
+                continue
+            if ch == quote:
+                quote = None
+        elif ch in '"\'`':
+            quote = ch
+        elif query.startswith('&&', i):
+            terms.append(''.join(current).strip())
+            current = []
+            i += 2
+            continue
+        current.append(ch)
+        i += 1
+    terms.append(''.join(current).strip())
+    return [t for t in terms if t]
+
+_FILTER_TERM = re.compile(r'^\{(?P<col>.+?)\}\s*(?P<op>is\s+\w+|[<>!=]=?|[a-z]+)\s*(?P<value>.*)$')
+_FILTER_OPS = {'=': 'eq', '!=': 'ne', '<': 'lt', '<=': 'le', '>': 'gt', '>=': 'ge'}
+
+def parse_filter_value(raw):
+    # Returns (text, number); number is None unless the value is an unquoted number
+    raw = raw.strip()
+    if len(raw) >= 2 and raw[0] in '"\'`' and raw[-1] == raw[0]:
+        return re.sub(r'\\(.)', r'\1', raw[1:-1]), None
+    try:
+        return raw, float(raw)
+    except ValueError:
+        return raw, None
+
+def filter_term_mask(series, op, text, number):
+    if op.startswith('is '):
+        kind = op.split()[-1]
+        if kind in ('blank', 'nil'):
+            return series.isna() | (series.astype(str) == "")
+        if kind == 'num':
+            return pd.to_numeric(series, errors='coerce').notna()
+        if kind == 'str':
+            return series.map(lambda v: isinstance(v, str))
+        return None
+    # Letter operators take an optional i (insensitive) / s (sensitive) prefix
+    case = True
+    if op[:1] in ('i', 's') and op[1:] in ('eq', 'ne', 'lt', 'le', 'gt', 'ge', 'contains', 'datestartswith'):
+        case, op = op[0] == 's', op[1:]
+    op = _FILTER_OPS.get(op, op)
+    strings = series.astype(str).where(series.notna(), "")
+    if op == 'contains':
+        return strings.str.contains(text, case=case, regex=False)
+    if op == 'datestartswith':
+        return strings.str.startswith(text)
+    if op not in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+        return None
+    if number is not None and pd.api.types.is_numeric_dtype(series):
+        left, right = series, number
+    elif case:
+        left, right = strings, text
+    else:
+        left, right = strings.str.lower(), text.lower()
+    mask = getattr(left, op)(right)
+    return mask if op == 'ne' else mask & series.notna()
+
+def filter_mask(frame, query):
+    # Translate DataTable filter_query syntax into a vectorized boolean mask;
+    # terms on unknown columns or with unsupported operators are ignored
+    mask = np.ones(len(frame), dtype=bool)
+    for term in split_filter_query(query or ""):
+        match = _FILTER_TERM.match(term)
+        if not match or match.group('col') not in frame.columns:
+            continue
+        op = re.sub(r'\s+', ' ', match.group('op'))
+        term_mask = filter_term_mask(frame[match.group('col')], op, *parse_filter_value(match.group('value')))
+        if term_mask is not None:
+            mask &= term_mask.fillna(False).to_numpy(dtype=bool)
+    return mask
+
+def sort_key(series):
+    # Object columns sort numerically when every non-blank value is a number, else as text
+    if pd.api.types.is_numeric_dtype(series) or not pd.api.types.is_object_dtype(series):
+        return series
+    numbers = pd.to_numeric(series, errors='coerce')
+    filled = series.notna() & (series.astype(str) != "")
+    if numbers[filled].notna().all():
+        return numbers
+    return series.astype(str).where(series.notna(), None)
+
+def table_view(key, frame, sort_by, filter_query):
+    # Row positions of the table after filtering and sorting
+    view_key = (key, json.dumps(sort_by or [], sort_keys=True), filter_query or "")
+    rows = _view_cache.get(view_key)
+    if rows is None:
+        rows = np.flatnonzero(filter_mask(frame, filter_query))
+        sort_by = [s for s in (sort_by or []) if s['column_id'] in frame.columns]
+        if sort_by and len(rows):
+            view = frame.iloc[rows].reset_index(drop=True)
+            order = view.sort_values(
+                by=[s['column_id'] for s in sort_by],
+                ascending=[s['direction'] == 'asc' for s in sort_by],
+                kind='mergesort',
+                na_position='last',
+                key=sort_key,
+            ).index.to_numpy()
+            rows = rows[order]
+        rows = _view_cache.put(view_key, rows)
+    return rows
+
+def table_records(frame, rows):
+    # Records for the DataTable; the row position is the stable row id
+    page = frame.iloc[rows]
+    records = page.astype(object).where(page.notna(), None).to_dict('records')
+    for row_id, record in zip(rows.tolist(), records):
+        record['id'] = row_id
+    return records
+
+def table_row(frame, row_id):
+    return table_records(frame, np.array([row_id]))[0]
+
+# Generated files above this size are served from /downloads instead of through the callback
+DOWNLOAD_INLINE_MB = int(os.getenv("DOWNLOAD_INLINE_MB", "50"))
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", os.path.join(tempfile.gettempdir(), "pairwise-downloads"))
+DOWNLOAD_MAX_AGE_HOURS = float(os.getenv("DOWNLOAD_MAX_AGE_HOURS", "24"))
+
+def send_generated_file(write, filename):
+    # Run write(path) into the download directory. Small files go back through dcc.Download;
+    # large ones stay on disk and a link to /downloads is returned instead
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    prune_dir(DOWNLOAD_DIR, DOWNLOAD_MAX_AGE_HOURS)
+    name = f"{uuid.uuid4().hex}_{filename}"
+    path = os.path.join(DOWNLOAD_DIR, name)
+    write(path)
+    size = os.path.getsize(path)
+    if size <= DOWNLOAD_INLINE_MB * 1024 * 1024:
+        data = dcc.send_file(path, filename)
+        os.remove(path)
+        return data, ""
+    return dash.no_update, html.A(f"Download {filename} ({format_bytes(size)})", href=f"/downloads/{name}")
+
+# Builds, exports and pair generation run as background callbacks: each job is a separate
+# process (so jobs use all cores and never block a web worker), coordinated through diskcache
+BACKGROUND_CACHE_DIR = os.getenv("BACKGROUND_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pairwise-jobs"))
+_job_cache = None
+
+def job_cache():
+    # Opened on first use rather than at import. diskcache reconnects after a fork, so the one
+    # handle serves a --preload master, the web workers forked from it and their jobs
+    global _job_cache
+    if _job_cache is None:
+        _job_cache = diskcache.Cache(BACKGROUND_CACHE_DIR)
+    return _job_cache
+
+# Callbacks declared with @callback (same arguments as app.callback) are registered on each
+# app create_app builds, so importing this module doesn't build one
+_callbacks = []
+
+def callback(*args, **kwargs):
+    def collect(fn):
+        _callbacks.append((args, kwargs, fn))
+        return fn
+    return collect
+
+# Instrumentation: each callback call is logged as one JSON line (wall time split into phases,
+# rows processed, payload bytes in and out) and summed into the Prometheus metrics at /metrics.
+# Jobs run in their own processes, so the sums are kept in the shared job diskcache.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+logger = logging.getLogger("pairwise")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_log_handler)
+logger.setLevel(LOG_LEVEL)
+
+# With PROFILE_DIR set, each call (of the PROFILE_CALLBACKS, if given) is profiled into that
+# directory: cProfile .prof files, or pyinstrument .html pages with PROFILER=pyinstrument
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILER = os.getenv("PROFILER", "cprofile")
+PROFILE_CALLBACKS = set(filter(None, os.getenv("PROFILE_CALLBACKS", "").split(',')))
+
+_METRICS_KEY = "pairwise-metrics"
+_DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+_METRIC_FAMILIES = {
+    'pairwise_callback_calls_total': ('counter', "Callback calls"),
+    'pairwise_callback_errors_total': ('counter', "Callback calls that raised"),
+    'pairwise_callback_duration_seconds': ('histogram', "Callback wall time"),
+    'pairwise_callback_phase_seconds_total': ('counter', "Callback wall time by phase"),
+    'pairwise_callback_rows_total': ('counter', "Rows processed by callbacks"),
+    'pairwise_callback_bytes_in_total': ('counter', "Callback argument payload bytes"),
+    'pairwise_callback_bytes_out_total': ('counter', "Callback output payload bytes"),
+    'pairwise_cache_bytes': ('gauge', "Bytes held by the web server's caches"),
+    'pairwise_cache_entries': ('gauge', "Entries in the web server's caches"),
+}
+
+
+def payload_bytes(value):
+    # Approximate size of callback arguments or output as JSON, as Dash sends them. Strings,
+    # lists and dicts are measured in place, so an inline download (up to DOWNLOAD_INLINE_MB of
+    # base64) is not serialized a second time just to be counted; other values (components,
+    # numbers) are small and serialized
+    if isinstance(value, flask.Response):
+        return value.content_length or 0
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, (list, tuple)):
+        return sum(payload_bytes(item) for item in value) + len(value) + 1
+    if isinstance(value, dict):
+        return sum(len(str(key)) + 3 + payload_bytes(item) for key, item in value.items()) + len(value) + 1
+    from plotly.io.json import to_json_plotly
+    try:
+        return len(to_json_plotly(value))
+    except (TypeError, ValueError):
+        return 0
+
+@contextlib.contextmanager
+def profiled(name):
+    if not PROFILE_DIR or (PROFILE_CALLBACKS and name not in PROFILE_CALLBACKS):
+        yield
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}")
+    if PROFILER == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path + ".html", "w") as f:
+                f.write(profiler.output_html())
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path + ".prof")
+
+def record_callback(timer, error=None):
+    logger.info(json.dumps({
+        "event": "callback", "callback": timer.name, "seconds": round(timer.seconds, 4),
+        "phases": {name: round(seconds, 4) for name, seconds in timer.phases.items()},
+        "rows": timer.rows, "bytes_in": timer.bytes_in, "bytes_out": timer.bytes_out,
+        "error": error, "pid": os.getpid(),
+    }))
+    labels = (('callback', timer.name),)
+    updates = [
+        ('pairwise_callback_calls_total', labels, 1),
+        ('pairwise_callback_errors_total', labels, int(error is not None)),
+        ('pairwise_callback_rows_total', labels, timer.rows),
+        ('pairwise_callback_bytes_in_total', labels, timer.bytes_in),
+        ('pairwise_callback_bytes_out_total', labels, timer.bytes_out),
+        ('pairwise_callback_duration_seconds_sum', labels, timer.seconds),
+        ('pairwise_callback_duration_seconds_count', labels, 1),
+    ]
+    updates += [('pairwise_callback_duration_seconds_bucket', labels + (('le', str(le)),), int(timer.seconds <= le))
+                for le in _DURATION_BUCKETS]
+    updates.append(('pairwise_callback_duration_seconds_bucket', labels + (('le', '+Inf'),), 1))
+    updates += [('pairwise_callback_phase_seconds_total', labels + (('phase', name),), seconds)
+                for name, seconds in timer.phases.items()]
+    cache = job_cache()
+    try:
+        with cache.transact():
+            metrics = cache.get(_METRICS_KEY, {})
+            for name, series_labels, value in updates:
+                metrics[name, series_labels] = metrics.get((name, series_labels), 0) + value
+            cache.set(_METRICS_KEY, metrics)
+    except diskcache.Timeout:
+        logger.warning(json.dumps({"event": "metrics_dropped", "callback": timer.name}))
+
+def instrumented(fn):
+    # Time, log and count every call of a callback or route
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # set_progress (background callbacks) is not part of the payload
+        timer = CallbackTimer(fn.__name__, payload_bytes([a for a in args if not callable(a)]))
+        token = _callback_timer.set(timer)
+        error = None
+        try:
+            with profiled(fn.__name__):
+                result = fn(*args, **kwargs)
+            timer.phase("serialize")
+            timer.bytes_out = payload_bytes(result)
+            return result
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            timer.phase(None)
+            _callback_timer.reset(token)
+            record_callback(timer, error)
+    return wrapper
+
+def metrics_text():
+    # Prometheus text exposition of the summed callback metrics plus this process's cache sizes
+    # (the web server's; background jobs run in forks whose caches go away with them)
+    metrics = dict(job_cache().get(_METRICS_KEY, {}))
+    for cache, held in {**CACHES, "views": _view_cache}.items():
+        metrics['pairwise_cache_bytes', (('cache', cache),)] = held.memory()
+        metrics['pairwise_cache_entries', (('cache', cache),)] = len(held)
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    lines = []
+    for family, (kind, description) in _METRIC_FAMILIES.items():
+        lines += [f"# HELP {family} {description}", f"# TYPE {family} {kind}"]
+        for (name, labels), value in metrics.items():
+            if name == family or (kind == 'histogram' and name.rsplit('_', 1)[0] == family):
+                label_text = ",".join(f'{key}="{escape(val)}"' for key, val in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+    return "\n".join(lines) + "\n"
+
+def serve_metrics():
+    return flask.Response(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+@instrumented
+def receive_upload():
+    # Raw file body from the browser (no base64); parsed once, then referenced by key
+    filename = flask.request.args.get('filename', '')
+    if not filename.lower().endswith(UPLOAD_EXTENSIONS):
+        return flask.jsonify(error=f"Unsupported file type: {filename}"), 400
+    phase("save")
+    try:
+        key = save_upload(flask.request.stream, filename)
+    except ValueError as e:
+        return flask.jsonify(error=str(e)), 413
+    count(bytes_in=os.path.getsize(upload_path(key)))
+    phase("preview")
+    preview = upload_preview(key)
+    if preview.empty:
+        os.remove(os.path.join(UPLOAD_DIR, key))
+        return flask.jsonify(error=f"Could not read {filename}"), 400
+    count(rows=len(preview))
+    return flask.jsonify(key=key)
+
+# Sends a dcc.Upload's file to /upload as raw bytes and returns the upload key. The data URL
+# stays in the browser; server callbacks only ever see the key.
+UPLOAD_JS = """
+async function(contents, filename) {
+    if (!contents || !filename) {
+        return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+    }
+    const blob = await (await fetch(contents)).blob();
+    const response = await fetch('%s?filename=' + encodeURIComponent(filename), {
+        method: 'POST',
+        headers: {'Content-Type': 'application/octet-stream'},
+        body: blob,
+    });
+    const result = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        return [null, result.error || ('Could not upload ' + filename + ' (HTTP ' + response.status + ')')];
+    }
+    return [result.key, null];
+}
+"""
+
+@instrumented
+def serve_download(name):
+    return flask.send_from_directory(DOWNLOAD_DIR, name, as_attachment=True, download_name=name.split('_', 1)[-1])
   
-def parse_contents(contents, filename):  
-    content_type, content_string = contents.split(',')  
-    decoded = base64.b64decode(content_string)  
-    try:  
-        if filename.lower().endswith('.csv'):  
-            return pd.read_csv(io.StringIO(decoded.decode('utf-8')))  
-        elif filename.lower().endswith(('.xls', '.xlsx')):  
-            return pd.read_excel(io.BytesIO(decoded))  
-    except Exception as e:  
-        print(f"Error parsing {filename}: {e}")  
-    return pd.DataFrame()  
-  
-def parse_metadata_string(s):  
-    if pd.isnull(s):  
-        return set()  
-    return set(a.strip() for a in s.split(',') if a.strip())  
-  
-app = dash.Dash(__name__, suppress_callback_exceptions=True, external_stylesheets=[dbc.themes.LUX])  
-server = app.server  
-  
-app.layout = html.Div([  
-    html.H2("Pairwise Record Comparison"),  
-    html.Div([  
-        html.Button('(Optional) Generate Pairwise Table from List of IDs', id='gen-pairs-btn', n_clicks=0),  
-        html.Div(id='upload-list-div', style={'marginTop':10}),  
-        dcc.Download(id='download-pairs-table'),  
-    ]),  
-    html.Hr(style={'marginTop':20}), 
-    html.Div([  
+def serve_layout():
+    # Built for each page load (Dash calls it per visitor) rather than at import
+    return html.Div([  
+        html.H2("Pairwise Record Comparison"),  
         html.Div([  
-            html.H5("Upload Pairwise Table (with two IDs per row)"),  
-            dcc.Upload(id='upload-pairs',  
-                children=html.Button('Upload Pairs Table'), multiple=False),  
-            html.Div(id='pairs-uploaded', style={'marginBottom':10, 'color':'green'})  
-        ], style={'width':'49%', 'display':'inline-block'}),  
+            html.Button('(Optional) Generate Pairwise Table from List of IDs', id='gen-pairs-btn', n_clicks=0),  
+            html.Div(id='upload-list-div', style={'marginTop':10}),  
+            dcc.Download(id='download-pairs-table'),  
+        ]),  
+        html.Hr(style={'marginTop':20}), 
         html.Div([  
-            html.H5("Upload ID Metadata Table"),  
-            dcc.Upload(id='upload-lookup',  
-                children=html.Button('Upload Metadata Table'), multiple=False),  
-            html.Div(id='lookup-uploaded', style={'marginBottom':10, 'color':'green'})  
-        ], style={'width':'49%', 'display':'inline-block'}),  
-    ]),  
-    html.Br(),  
-    # Dummy dropdowns for suppress_callback_exceptions (hidden)  
-    dcc.Dropdown(id='sel-id1', options=[], style={'display': 'none'}),  
-    dcc.Dropdown(id='sel-id2', options=[], style={'display': 'none'}),  
-    dcc.Dropdown(id='sel-sim', options=[], style={'display': 'none'}),  
-    dcc.Dropdown(id='sel-lookup-id', options=[], style={'display': 'none'}),  
-    dcc.Dropdown(id='sel-lookup-name', options=[], style={'display': 'none'}),  
-    dcc.Dropdown(id='sel-lookup-usage', options=[], style={'display': 'none'}),  
-    dcc.Dropdown(id='sel-lookup-meta', options=[], style={'display': 'none'}),  
-    html.Div(id='column-selectors'),  
-    html.Br(),  
+            html.Div([  
+                html.H5("Upload Pairwise Table (with two IDs per row)"),  
+                dcc.Upload(id='upload-pairs',  
+                    children=html.Button('Upload Pairs Table'), multiple=False),  
+                html.Div(id='pairs-uploaded', style={'marginBottom':10, 'color':'green'})  
+            ], style={'width':'49%', 'display':'inline-block'}),  
+            html.Div([  
+                html.H5("Upload ID Metadata Table"),  
+                dcc.Upload(id='upload-lookup',  
+                    children=html.Button('Upload Metadata Table'), multiple=False),  
+                html.Div(id='lookup-uploaded', style={'marginBottom':10, 'color':'green'})  
+            ], style={'width':'49%', 'display':'inline-block'}),  
+        ]),  
+        # Keys into the server-side upload cache, or why /upload rejected the file
+        dcc.Store(id='pairs-upload-key'),
+        dcc.Store(id='lookup-upload-key'),
+        dcc.Store(id='pairs-upload-error'),
+        dcc.Store(id='lookup-upload-error'),
+        html.Br(),  
+        # Dummy dropdowns for suppress_callback_exceptions (hidden)  
+        dcc.Dropdown(id='sel-id1', options=[], style={'display': 'none'}),  
+        dcc.Dropdown(id='sel-id2', options=[], style={'display': 'none'}),  
+        dcc.Dropdown(id='sel-sim', options=[], style={'display': 'none'}),  
+        dcc.Dropdown(id='sel-lookup-id', options=[], style={'display': 'none'}),  
+        dcc.Dropdown(id='sel-lookup-name', options=[], style={'display': 'none'}),  
+        dcc.Dropdown(id='sel-lookup-usage', options=[], style={'display': 'none'}),  
+        dcc.Dropdown(id='sel-lookup-meta', options=[], style={'display': 'none'}),  
+        html.Div(id='column-selectors'),  
+        html.Br(),  
   
-    # Static compare-columns dropdown (always present)  
-    html.Div([  
-        html.Label("Columns to compare for shared/unique values (use for attributes/metadata):"),  
-        dcc.Dropdown(  
-            id='compare-columns',  
-            options=[],  
-            value=[],  
-            multi=True  
-        ),  
-    ], style={'marginBottom': '15px'}),  
+        # Static compare-columns dropdown (always present)  
+        html.Div([  
+            html.Label("Columns to compare for shared/unique values (use for attributes/metadata):"),  
+            dcc.Dropdown(  
+                id='compare-columns',  
+                options=[],  
+                value=[],  
+                multi=True  
+            ),  
+        ], style={'marginBottom': '15px'}),  
+        # Optional pre-filter on the similarity/score column, applied before joining and comparing
+        html.Div([
+            html.Label("(Optional) Keep only the top k pairs per ID 1 by score:", style={'marginRight': 10}),
+            dcc.Input(id='top-k', type='number', min=1, step=1, placeholder='all', style={'width': 100, 'marginRight': 30}),
+            html.Label("(Optional) Minimum score:", style={'marginRight': 10}),
+            dcc.Input(id='min-score', type='number', placeholder='none', style={'width': 100}),
+        ], style={'marginBottom': '15px'}),
+        # Where the similarity/score comes from: the pairs file, or computed from the metadata column
+        html.Div([
+            html.Label("Similarity/Score:", style={'marginRight': 10}),
+            dcc.RadioItems(id='score-method', options=[
+                {"label": "Score column from the pairs file", "value": "column"},
+            ] + [{"label": label, "value": value} for value, label in SIMILARITY_METRICS.items()],
+                value='column', inline=True, inputStyle={'marginRight': 5, 'marginLeft': 10},
+                style={'display': 'inline-block'}),
+        ], style={'marginBottom': '15px'}),
   
-    html.Br(),  
-    html.Div(id="display-column-selector"),  
-    html.Button("Show Merged Table", id='show-btn', n_clicks=0, style={'marginTop': '10px'}),  
-    html.Hr(),  
-    html.Div([  
-        html.Button("Export to Excel", id='export-btn', n_clicks=0, style={'marginRight': '10px'}),  
-        dcc.Download(id="download-xlsx")  
-    ]),  
-    html.Br(), 
-    # Always-present DataTable  
-    dash_table.DataTable(  
-        id='main-table',  
-        data=[],  
-        columns=[],  
-        page_size=10,  
-        row_selectable='single',  
-        sort_action='native',      # Enable sorting  
-        filter_action='native',    # Enable filtering  
-        selected_rows=[],  
-        style_table={'overflowX': 'auto'},  
-        style_cell={'minWidth':'120px', 'whiteSpace':'normal'},  
-        style_header={'backgroundColor':'#f4f4f4', 'fontWeight':700},  
-    ),  
-    html.Br(), 
-    html.Div(id='comparison-card')  
-])  
-
-@app.callback(  
+        html.Br(),  
+        html.Div(id="display-column-selector"),  
+        html.Button("Show Merged Table", id='show-btn', n_clicks=0, style={'marginTop': '10px'}),  
+        html.Button("Cancel", id='cancel-build-btn', n_clicks=0, disabled=True, style={'marginTop': '10px', 'marginLeft': '10px'}),
+        html.Progress(id='build-progress', value=0, max=1, style={'display': 'none'}),
+        html.Div(id='build-status', style={'marginTop': 5}),
+        html.Hr(),  
+        html.Div([  
+            html.Button("Export to Excel", id='export-btn', n_clicks=0, style={'marginRight': '10px'}),  
+            html.Button("Cancel", id='cancel-export-btn', n_clicks=0, disabled=True),
+            html.Div(id='export-progress', style={'marginTop': 5}),
+            dcc.Download(id="download-xlsx"),  
+            html.Div(id='export-status', style={'marginTop': 10}),
+        ]),  
+        html.Br(), 
+        # Key of the merged table held server-side
+        dcc.Store(id='table-key'),
+        # Always-present DataTable; paging, sorting and filtering run on the server  
+        dash_table.DataTable(  
+            id='main-table',  
+            data=[],  
+            columns=[],  
+            page_current=0,
+            page_size=10,  
+            page_count=0,
+            page_action='custom',
+            row_selectable='single',  
+            sort_action='custom',      # Enable sorting  
+            sort_by=[],
+            filter_action='custom',    # Enable filtering  
+            filter_query='',
+            selected_rows=[],  
+            style_table={'overflowX': 'auto'},  
+            style_cell={'minWidth':'120px', 'whiteSpace':'normal'},  
+            style_header={'backgroundColor':'#f4f4f4', 'fontWeight':700},  
+        ),  
+        html.Br(), 
+        html.Div(id='comparison-card')  
+    ])  
+
+@callback(  
     Output('upload-list-div', 'children'),  
     Input('gen-pairs-btn', 'n_clicks')  
 )  
+@instrumented
 def show_list_upload(n_clicks):  
     if n_clicks == 0:  
         return ""  
     return html.Div([  
-        html.H5("Upload list of IDs (CSV or Excel; single column named 'ID' or similar)"),  
+        html.H5("Upload list of IDs (CSV, Excel, Parquet or Feather; single column named 'ID' or similar)"),  
         dcc.Upload(id='upload-id-list', children=html.Button('Upload ID List'), multiple=False),  
-        html.Div(id='id-list-uploaded', style={'marginBottom':10,'color':'green'}),  
-        html.Button('Download All Pairwise Comparisons', id='download-pairs-btn', n_clicks=0, style={'marginTop':10})  
+        dcc.Store(id='id-list-key'),
+        dcc.Store(id='id-list-error'),
+        html.Div(id='id-list-uploaded', style={'color':'green'}),  
+        html.Div(id='pairs-estimate', style={'marginBottom':10,'color':'green'}),
+        html.H6("(Optional) Only pair IDs that share metadata tokens"),
+        dcc.Upload(id='upload-block-meta', children=html.Button('Upload Metadata for Blocking'), multiple=False),
+        dcc.Store(id='block-meta-key'),
+        dcc.Store(id='block-meta-error'),
+        html.Div(id='block-meta-uploaded', style={'marginBottom':10,'color':'green'}),
+        html.Div([
+            html.Div([
+                html.Label("Metadata ID column:"),
+                dcc.Dropdown(id='block-id-col', options=[]),
+            ], style={'width': '25%', 'display': 'inline-block', 'marginRight': '5%'}),
+            html.Div([
+                html.Label("Blocking columns:"),
+                dcc.Dropdown(id='block-columns', options=[], value=[], multi=True),
+            ], style={'width': '35%', 'display': 'inline-block', 'marginRight': '5%'}),
+            html.Div([
+                html.Label("Min shared tokens:"),
+                dcc.Input(id='block-min-shared', type='number', min=1, step=1, value=1),
+            ], style={'width': '12%', 'display': 'inline-block', 'marginRight': '3%'}),
+            html.Div([
+                html.Label("Max IDs per token:"),
+                dcc.Input(id='block-max-size', type='number', min=2, step=1, placeholder='No cap'),
+            ], style={'width': '12%', 'display': 'inline-block'}),
+        ], style={'marginBottom': 10}),
+        html.Div([
+            dcc.RadioItems(id='block-method', options=[
+                {"label": "Pair IDs sharing at least the min shared tokens", "value": "tokens"},
+                {"label": "Pair IDs with Jaccard similarity of at least (MinHash LSH; adds a score column):", "value": "minhash"},
+            ], value='tokens', inline=True, inputStyle={'marginRight': 5, 'marginLeft': 10},
+               style={'display': 'inline-block', 'marginRight': 10}),
+            dcc.Input(id='block-threshold', type='number', min=0.05, max=1, step=0.05, value=0.5, style={'width': 80}),
+        ], style={'marginBottom': 10}),
+        html.Label("Output format:"),
+        dcc.RadioItems(id='pairs-format', options=[{"label": v, "value": k} for k, v in PAIRS_FORMATS.items()],
+                       value='xlsx', inline=True, inputStyle={'marginRight': 5, 'marginLeft': 10}),
+        html.Button('Download All Pairwise Comparisons', id='download-pairs-btn', n_clicks=0, style={'marginTop':10}),  
+        html.Button('Cancel', id='cancel-pairs-btn', n_clicks=0, disabled=True, style={'marginTop':10, 'marginLeft':10}),
+        html.Div(id='pairs-progress', style={'marginTop':5}),
+        html.Div(id='pairs-download-status', style={'marginTop':10})
     ])  
   
-@app.callback(  
+@callback(
+    Output('block-meta-uploaded', 'children'),
+    Output('block-id-col', 'options'),
+    Output('block-id-col', 'value'),
+    Output('block-columns', 'options'),
+    Input('block-meta-key', 'data'),
+    State('upload-block-meta', 'filename'),
+    State('block-meta-error', 'data'),
+)
+@instrumented
+def update_blocking_selectors(block_key, filename, error):
+    df = upload_preview(block_key)
+    if df.empty:
+        return upload_status(filename, error or f"Could not read {filename}"), [], None, []
+    options = [{"label": c, "value": c} for c in df.columns]
+    return f"File uploaded: {filename}", options, pick_id_column(df), options
+  
+@callback(  
     Output('id-list-uploaded', 'children'),  
-    Input('upload-id-list', 'filename')  
+    Input('id-list-key', 'data'),  
+    State('upload-id-list', 'filename'),  
+    State('id-list-error', 'data'),
 )  
-def show_id_list_filename(filename):  
-    return f"File uploaded: {filename}" if filename else ""  
+@instrumented
+def show_id_list_filename(id_list_key, filename, error):  
+    return upload_status(filename, error or (None if id_list_key else f"Could not read {filename}"))
+
+@callback(
+    Output('pairs-estimate', 'children'),
+    Input('id-list-key', 'data'),
+    Input('pairs-format', 'value'),
+    Input('block-meta-key', 'data'),
+    Input('block-id-col', 'value'),
+    Input('block-columns', 'value'),
+    Input('block-min-shared', 'value'),
+    Input('block-max-size', 'value'),
+    Input('block-method', 'value'),
+    Input('block-threshold', 'value'),
+    background=True,
+    running=[(Output('pairs-estimate', 'style'), {'marginBottom':10, 'color':'gray'}, {'marginBottom':10, 'color':'green'})],
+)
+@instrumented
+def estimate_pairs(id_list_key, fmt, block_key, block_id_col, block_cols, min_shared, max_block_size, method, threshold):
+    # A background job since blocking reads and tokenizes the metadata; only an upper bound is
+    # counted, the pairs themselves are generated by make_pairs
+    if not id_list_key:
+        return ""
+    try:
+        ids, n_pairs, blocked = estimate_pair_count(id_list_key, block_key, block_id_col, block_cols, min_shared, max_block_size, method, threshold)
+    except ValueError as e:
+        return str(e)
+    if ids is None:
+        return ""
+    estimate = f"{len(ids):,} IDs -> {len(ids) * (len(ids) - 1) // 2:,} pairs"
+    if blocked:
+        estimate += f", at most {n_pairs:,} sharing a token" if method == 'minhash' else f", at most {n_pairs:,} after blocking"
+    estimate += f", up to about {format_bytes(estimate_pairs_output(ids, n_pairs, fmt))}"
+    if fmt == 'xlsx':
+        sheets = max(-(-n_pairs // (EXCEL_MAX_ROWS - 1)), 1)
+        estimate += f" over {sheets} sheet{'s' if sheets > 1 else ''}"
+        if n_pairs > MAX_EXCEL_PAIRS:
+            estimate += " (may be too many for Excel; choose CSV or Parquet)"
+    return estimate
   
-@app.callback(  
+@callback(  
     Output('download-pairs-table', 'data'),  
+    Output('pairs-download-status', 'children'),  
     Input('download-pairs-btn', 'n_clicks'),  
-    State('upload-id-list', 'contents'),  
-    State('upload-id-list', 'filename'),  
+    State('id-list-key', 'data'),  
+    State('pairs-format', 'value'),  
+    State('block-meta-key', 'data'),  
+    State('block-id-col', 'value'),  
+    State('block-columns', 'value'),  
+    State('block-min-shared', 'value'),  
+    State('block-max-size', 'value'),  
+    State('block-method', 'value'),
+    State('block-threshold', 'value'),
+    background=True,
+    running=[
+        (Output('download-pairs-btn', 'disabled'), True, False),
+        (Output('cancel-pairs-btn', 'disabled'), False, True),
+    ],
+    progress=[Output('pairs-progress', 'children')],
+    cancel=[Input('cancel-pairs-btn', 'n_clicks')],
     prevent_initial_call=True  
 )  
-def make_pairs(n_clicks, contents, filename):  
-    if not n_clicks or not contents or not filename:  
-        return dash.no_update  
-    # Parse the upload as you do elsewhere:  
-    df = parse_contents(contents, filename)  
-    if df.empty:  
-        return dash.no_update  
-    # Try to pick the column to use for IDs:  
-    id_col = next((c for c in df.columns if 'id' in c.lower()), df.columns[0])  
-    ids = df[id_col].dropna().unique().tolist()  
-    # -- choose combinations (unordered, no repeats) or permutations (ordered, no repeats) --  
-    # Usually for record linkage: use unordered pairs.  
-    pair_rows = [{'ID1': a, 'ID2': b} for a, b in combinations(ids, 2)]  
-    out_df = pd.DataFrame(pair_rows)  
-    # Save as Excel in memory for download  
-    output = io.BytesIO()  
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:  
-        out_df.to_excel(writer, index=False, sheet_name='Pairs')  
-    output.seek(0)  
-    return dcc.send_bytes(output.getvalue(), 'pairs_table.xlsx') 
-
-@app.callback(  
+@instrumented
+def make_pairs(set_progress, n_clicks, id_list_key, fmt, block_key, block_id_col, block_cols, min_shared, max_block_size, method='tokens', threshold=None):  
+    if not n_clicks or not id_list_key:  
+        return dash.no_update, dash.no_update  
+    # IDs from the list's ID-like column, plus the blocked candidate pairs if configured
+    phase("plan")
+    try:
+        ids, keys, scores = plan_pairs(id_list_key, block_key, block_id_col, block_cols, min_shared, max_block_size, method, threshold)
+    except ValueError as e:
+        return dash.no_update, str(e)
+    if ids is None:  
+        return dash.no_update, dash.no_update  
+    fmt = fmt if fmt in PAIRS_FORMATS else 'xlsx'
+    # Unordered pairs (no repeats), generated in blocks and streamed to disk  
+    n_pairs, blocks = pair_blocks(ids, keys, scores)
+    if fmt == 'xlsx' and n_pairs > MAX_EXCEL_PAIRS:
+        return dash.no_update, f"{n_pairs:,} pairs is too many for Excel; choose CSV or Parquet."
+    phase("write")
+    count(rows=n_pairs)
+    def report(written):
+        set_progress(f"Wrote {written:,} of {n_pairs:,} pairs")
+    return send_generated_file(lambda path: write_pairs(ids, blocks, path, fmt, report, scored=scores is not None), f"pairs_table.{fmt}")
+
+@callback(  
     Output('pairs-uploaded', 'children'),  
     Output('lookup-uploaded', 'children'),  
     Input('upload-pairs', 'filename'),  
-    Input('upload-lookup', 'filename')  
+    Input('upload-lookup', 'filename'),  
+    Input('pairs-upload-error', 'data'),
+    Input('lookup-upload-error', 'data'),
 )  
-def show_filenames(pairs_name, lookup_name):  
-    up1 = f"File uploaded: {pairs_name}" if pairs_name else ""  
-    up2 = f"File uploaded: {lookup_name}" if lookup_name else ""  
-    return up1, up2  
+@instrumented
+def show_filenames(pairs_name, lookup_name, pairs_error, lookup_error):  
+    return upload_status(pairs_name, pairs_error), upload_status(lookup_name, lookup_error)
+  
+def upload_status(filename, error=None):
+    # Line under an upload: its name, or the reason it could not be uploaded or read
+    if not filename:
+        return ""
+    if error:
+        return html.Span(error, style={'color': 'crimson'})
+    return f"File uploaded: {filename}"
   
-@app.callback(  
+@callback(  
     Output('column-selectors', 'children'),  
-    Input('upload-pairs', 'contents'),  
-    Input('upload-pairs', 'filename'),  
-    Input('upload-lookup', 'contents'),  
-    Input('upload-lookup', 'filename'),  
+    Input('pairs-upload-key', 'data'),  
+    Input('lookup-upload-key', 'data'),  
+    State('upload-pairs', 'filename'),  
+    State('upload-lookup', 'filename'),  
+    State('pairs-upload-error', 'data'),
+    State('lookup-upload-error', 'data'),
 )  
-def update_column_selectors(pairs_content, pairs_name, lookup_content, lookup_name):  
-    if not pairs_content or not lookup_content:  
+@instrumented
+def update_column_selectors(pairs_key, lookup_key, pairs_name, lookup_name, pairs_error, lookup_error):  
+    if not pairs_name or not lookup_name:  
         return ""  
-    pairs_df = parse_contents(pairs_content, pairs_name)  
-    lookup_df = parse_contents(lookup_content, lookup_name)  
+    pairs_df = upload_preview(pairs_key)
+    lookup_df = upload_preview(lookup_key)
     if pairs_df.empty or lookup_df.empty:  
-        return html.Div("One or both files could not be read. Please re-upload.")  
+        errors = [error for error in (pairs_error, lookup_error) if error]
+        return html.Div("; ".join(errors) + ". Please re-upload." if errors else "One or both files could not be read. Please re-upload.")  
   
     pair_cols = [{"label": c, "value": c} for c in pairs_df.columns]  
     lookup_cols = [{"label": c, "value": c} for c in lookup_df.columns]  
@@ -239,19 +757,19 @@ def update_column_selectors(pairs_content, pairs_name, lookup_content, lookup_na
         ]),  
     ])  
   
-@app.callback(  
+@callback(  
     Output('compare-columns', 'options'),  
     Output('compare-columns', 'value'),  
-    Input('upload-lookup', 'contents'),  
-    Input('upload-lookup', 'filename'),  
+    Input('lookup-upload-key', 'data'),  
     Input('sel-lookup-id', 'value'),  
     Input('sel-lookup-meta', 'value'),  
     prevent_initial_call=True  
 )  
-def update_compare_columns_dropdown(lookup_content, lookup_name, sel_id, sel_meta):  
-    if not lookup_content or not lookup_name or not sel_id:  
+@instrumented
+def update_compare_columns_dropdown(lookup_key, sel_id, sel_meta):  
+    if not lookup_key or not sel_id:  
         return [], []  
-    lookup_df = parse_contents(lookup_content, lookup_name)  
+    lookup_df = upload_preview(lookup_key)
     if lookup_df.empty:  
         return [], []  
     all_cols = lookup_df.columns  
@@ -259,16 +777,18 @@ def update_compare_columns_dropdown(lookup_content, lookup_name, sel_id, sel_met
     default_val = [sel_meta] if sel_meta in all_cols else []  
     return options, default_val  
   
-@app.callback(  
+@callback(  
     Output("display-column-selector", "children"),  
     Input('column-selectors', 'children'),  
+    Input('score-method', 'value'),
     State('sel-id1', 'value'),  
     State('sel-id2', 'value'),  
     State('sel-sim', 'value'),  
     State('sel-lookup-name', 'value'),  
     State('sel-lookup-usage', 'value'),  
 )  
-def update_display_column_selector(_, id1_col, id2_col, sim_col, name_col, usage_col):  
+@instrumented
+def update_display_column_selector(_, score_method, id1_col, id2_col, sim_col, name_col, usage_col):  
     if not (id1_col and id2_col):  
         return ""  
     options = [  
@@ -285,7 +805,7 @@ def update_display_column_selector(_, id1_col, id2_col, sim_col, name_col, usage
             {"label": f"{usage_col} (ID 1)", "value": f"{usage_col}_1"},  
             {"label": f"{usage_col} (ID 2)", "value": f"{usage_col}_2"},  
         ]  
-    if sim_col:  
+    if sim_col or score_method in SIMILARITY_METRICS:
         options.append({"label": "Similarity/Score", "value": "Similarity/Score"})  
     default_value = [o["value"] for o in options]  
     return html.Div([  
@@ -299,78 +819,42 @@ def update_display_column_selector(_, id1_col, id2_col, sim_col, name_col, usage
         html.Br(),  
     ])  
   
-@app.callback(  
+@callback(  
     Output("download-xlsx", "data"),  
+    Output("export-status", "children"),  
     Input("export-btn", "n_clicks"),  
-    State('main-table', 'data'),  
-    State('main-table', 'columns'),  
+    State('table-key', 'data'),  
     State('compare-columns', 'value'),  
+    background=True,
+    running=[
+        (Output('export-btn', 'disabled'), True, False),
+        (Output('cancel-export-btn', 'disabled'), False, True),
+    ],
+    progress=[Output('export-progress', 'children')],
+    cancel=[Input('cancel-export-btn', 'n_clicks')],
     prevent_initial_call=True  
 )  
-def export_to_excel(n_clicks, data, columns, compare_cols):  
-    if not n_clicks or not data or not columns:  
-        return dash.no_update  
-  
-    # Step 1: Build DataFrame and save to Excel in memory with openpyxl  
-    df = pd.DataFrame(data)  
-    output = io.BytesIO()  
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:  
-        df.to_excel(writer, index=False, sheet_name="Merged")  
-    output.seek(0)  
-    wb = load_workbook(output)  
-    ws = wb["Merged"]  
-  
-    # Step 2: Bold headers  
-    header_font = Font(bold=True)  
-    for cell in ws[1]:  
-        cell.font = header_font  
-  
-    # Step 3: Adjust column widths automatically  
-    for col in ws.columns:  
-        max_length = 0  
-        col_letter = col[0].column_letter  
-        for cell in col:  
-            try:  
-                value = str(cell.value)  
-            except:  
-                value = ""  
-            if value:  
-                max_length = max(max_length, len(value))  
-        ws.column_dimensions[col_letter].width = max(max_length + 2, 12)  # leave a little padding  
-  
-    # Step 4: Color relevant columns  
-    color_map = {}  
-    if compare_cols:  
-        for col in compare_cols:  
-            color_map[f"{col} | Shared in both"] = "D6F5D6"  
-            color_map[f"{col} | Unique to ID 1"] = "FFFACD"  
-            color_map[f"{col} | Unique to ID 2"] = "FFD9EC"  
+@instrumented
+def export_to_excel(set_progress, n_clicks, table_key, compare_cols):  
+    df = get_table(table_key)
+    if not n_clicks or df is None or df.empty:  
+        return dash.no_update, dash.no_update  
   
-    # Openpyxl rows/columns are 1-indexed and include header row  
-    col_indices = {cell.value: cell.column for cell in ws[1]}  
-  
-    for col, fillcolor in color_map.items():  
-        if col not in col_indices:  
-            continue  
-        col_idx = col_indices[col]  
-        fill = PatternFill(start_color=fillcolor, end_color=fillcolor, fill_type="solid")  
-        # start from row 2 (data)  
-        for row in range(2, ws.max_row + 1):  
-            cell = ws.cell(row=row, column=col_idx)  
-            if cell.value is not None and str(cell.value).strip() != "":  
-                cell.fill = fill  
-  
-    # Save workbook to BytesIO for download  
-    final_output = io.BytesIO()  
-    wb.save(final_output)  
-    final_output.seek(0)  
-    return dcc.send_bytes(final_output.getvalue(), "merged_comparison.xlsx") 
+    # Write the server-side table in one pass, with the shared/unique columns colored
+    phase("write")
+    count(rows=len(df))
+    def report(written):
+        set_progress(f"Wrote {written:,} of {len(df):,} rows")
+    return send_generated_file(
+        lambda path: export_table(path, df, compare_cols, report, result_key("xlsx", table_key, compare_cols)),
+        "merged_comparison.xlsx",
+    )
  
-@app.callback(  
-    Output('main-table', 'data'),  
+@callback(  
+    Output('table-key', 'data'),  
     Output('main-table', 'columns'),  
     Output('main-table', 'style_data_conditional'),  
-    Output('main-table', 'selected_rows'),  
+    Output('main-table', 'page_current', allow_duplicate=True),  
     Input('show-btn', 'n_clicks'),  
     State('sel-id1', 'value'),  
     State('sel-id2', 'value'),  
@@ -381,131 +865,102 @@ def export_to_excel(n_clicks, data, columns, compare_cols):
     State('sel-lookup-meta', 'value'),  
     State('compare-columns', 'value'),  
     State('display-columns', 'value'),  
-    State('upload-pairs', 'contents'),  
-    State('upload-pairs', 'filename'),  
-    State('upload-lookup', 'contents'),  
-    State('upload-lookup', 'filename'),  
+    State('pairs-upload-key', 'data'),  
+    State('lookup-upload-key', 'data'),  
+    State('top-k', 'value'),
+    State('min-score', 'value'),
+    State('score-method', 'value'),
+    background=True,
+    running=[
+        (Output('show-btn', 'disabled'), True, False),
+        (Output('cancel-build-btn', 'disabled'), False, True),
+        (Output('build-progress', 'style'), {'display': 'inline-block', 'marginLeft': 10}, {'display': 'none'}),
+    ],
+    progress=[Output('build-progress', 'value'), Output('build-progress', 'max'), Output('build-status', 'children')],
+    cancel=[Input('cancel-build-btn', 'n_clicks')],
     prevent_initial_call=True  
 )  
-def build_main_table(n_clicks, id1_col, id2_col, sim_col, lookup_id_col, name_col, usage_col, meta_col, compare_cols, display_cols, pairs_content, pairs_name, lookup_content, lookup_name):  
-    if not pairs_content or not lookup_content:  
-        return [], [], [], []  
-    pairs_df = parse_contents(pairs_content, pairs_name)  
-    lookup_df = parse_contents(lookup_content, lookup_name)  
-    if pairs_df.empty or lookup_df.empty:  
-        return [], [], [], []  
-    merged = pairs_df.copy()  
-    merged = merged.rename(columns={id1_col: "ID_1", id2_col: "ID_2"})  
-    merged = pd.merge(merged, lookup_df.rename(  
-        columns={lookup_id_col: "ID_1", name_col: "Name_1"}  
-    )[[ "ID_1", "Name_1"]], on="ID_1", how="left")  
-    merged = pd.merge(merged, lookup_df.rename(  
-        columns={lookup_id_col: "ID_2", name_col: "Name_2"}  
-    )[[ "ID_2", "Name_2"]], on="ID_2", how="left")  
-    if usage_col and usage_col in lookup_df.columns:  
-        merged = pd.merge(  
-            merged,  
-            lookup_df[[lookup_id_col, usage_col]].rename(columns={lookup_id_col: "ID_1", usage_col: f"{usage_col}_1"}),  
-            on="ID_1",  
-            how="left"  
-        )  
-        merged = pd.merge(  
-            merged,  
-            lookup_df[[lookup_id_col, usage_col]].rename(columns={lookup_id_col: "ID_2", usage_col: f"{usage_col}_2"}),  
-            on="ID_2",  
-            how="left"  
-        )  
-    if sim_col and sim_col in pairs_df.columns:  
-        merged["Similarity/Score"] = merged[sim_col]  
-        try:  
-            merged["Similarity/Score"] = merged["Similarity/Score"].apply(lambda x: round(float(x), 3) if pd.notnull(x) else "")  
-        except:  
-            pass  
+@instrumented
+def build_main_table(set_progress, n_clicks, id1_col, id2_col, sim_col, lookup_id_col, name_col, usage_col, meta_col, compare_cols, display_cols, pairs_key, lookup_key, top_k=None, min_score=None, score_method=None):  
+    if not pairs_key or not lookup_key:  
+        return None, [], [], 0  
+    try:
+        key, table = build_table(pairs_key, lookup_key, id1_col, id2_col, sim_col, lookup_id_col, name_col, usage_col, meta_col,
+                                 compare_cols, display_cols, top_k, min_score, score_method, progress=set_progress)
+    except ValueError as e:
+        set_progress((0, 1, str(e)))
+        return None, [], [], 0
+    if table is None:
+        return None, [], [], 0
+    # Highlight non-blank shared/unique cells of the compared columns
     style_data_conditional = []  
-    if compare_cols:  
-        for col in compare_cols:  
-            if col not in lookup_df.columns:  
-                continue  
-            col_is_numeric = pd.api.types.is_numeric_dtype(lookup_df[col])  # <<<< MODIFIED 
-            id_to_attr = dict(zip(lookup_df[lookup_id_col], lookup_df[col]))  
-            shared_list, uniq1_list, uniq2_list = [], [], []  
-            for idx, row in merged.iterrows():  
-                id1 = row["ID_1"]  
-                id2 = row["ID_2"]  
-                meta1 = id_to_attr.get(id1, "")  
-                meta2 = id_to_attr.get(id2, "")  
-                if col_is_numeric:  # <<<< MODIFIED  
-                    set1 = set([str(meta1)]) if pd.notnull(meta1) and meta1 != "" else set()  
-                    set2 = set([str(meta2)]) if pd.notnull(meta2) and meta2 != "" else set()  
-                else:  
-                    set1 = parse_metadata_string(meta1)  
-                    set2 = parse_metadata_string(meta2)  
-                shared = sorted(set1 & set2)  
-                uniq1 = sorted(set1 - set2)  
-                uniq2 = sorted(set2 - set1)  
-                shared_list.append(", ".join(shared))  
-                uniq1_list.append(", ".join(uniq1))  
-                uniq2_list.append(", ".join(uniq2))  
-            col_shared = f"{col} | Shared in both"  
-            col_uniq1 = f"{col} | Unique to ID 1"  
-            col_uniq2 = f"{col} | Unique to ID 2"  
-            merged[col_shared] = shared_list  
-            merged[col_uniq1] = uniq1_list  
-            merged[col_uniq2] = uniq2_list  
-            # Add highlighting for these columns  
-            style_data_conditional += [  
-                {  
-                    "if": {"column_id": col_shared, "filter_query": f'{{{col_shared}}} != ""'},  
-                    "backgroundColor": "#D6F5D6", "color": "black"  
-                },  
-                {  
-                    "if": {"column_id": col_uniq1, "filter_query": f'{{{col_uniq1}}} != ""'},  
-                    "backgroundColor": "#FFFACD", "color": "black"  
-                },  
-                {  
-                    "if": {"column_id": col_uniq2, "filter_query": f'{{{col_uniq2}}} != ""'},  
-                    "backgroundColor": "#FFD9EC", "color": "black"  
-                },  
-            ]  
-    all_compare_cols = []  
-    if compare_cols:  
-        for col in compare_cols:  
-            all_compare_cols += [  
-                f"{col} | Shared in both",  
-                f"{col} | Unique to ID 1",  
-                f"{col} | Unique to ID 2",  
-            ]  
-    final_cols = [col for col in display_cols if col in merged.columns]  
-    if all_compare_cols:  
-        final_cols += [col for col in all_compare_cols if col in merged.columns and col not in final_cols]  
+    for col in compare_cols or []:
+        for name, color in zip(compare_column_names(col), COMPARE_FILLS):
+            if name in table.columns:
+                style_data_conditional.append({
+                    "if": {"column_id": name, "filter_query": f'{{{name}}} != ""'},
+                    "backgroundColor": f"#{color}", "color": "black",
+                })
     columns = []  
-    for col in final_cols:  
+    for col in table.columns:
         # Decide if this column should be shown as numeric  
-        # Get column values from merged DataFrame  
-        if pd.api.types.is_numeric_dtype(merged[col]):  
+        if pd.api.types.is_numeric_dtype(table[col]):  
             columns.append({"name": col, "id": col, "type": "numeric"})  
         else:  
             columns.append({"name": col, "id": col, "type": "text"})    
-    data = merged[final_cols].to_dict('records')  
-    return data, columns, style_data_conditional, []  
+    steps = 2 + len(compare_cols or [])
+    status = f"Built {len(table):,} rows"
+    duplicates = table.attrs.get("lookup_duplicates", 0)
+    if duplicates:
+        status += f"; {duplicates:,} repeated IDs in the metadata table were ignored (last row used)"
+    set_progress((steps, steps, f"{status}. Table size {format_bytes(frame_nbytes(table))}"))
+    return key, columns, style_data_conditional, 0  
+
+@callback(
+    Output('main-table', 'data'),
+    Output('main-table', 'page_count'),
+    Output('main-table', 'page_current'),
+    Output('main-table', 'selected_rows'),
+    Input('table-key', 'data'),
+    Input('main-table', 'page_current'),
+    Input('main-table', 'page_size'),
+    Input('main-table', 'sort_by'),
+    Input('main-table', 'filter_query'),
+)
+@instrumented
+def update_table_page(table_key, page_current, page_size, sort_by, filter_query):
+    frame = get_table(table_key)
+    if frame is None:
+        return [], 0, 0, []
+    phase("view")
+    rows = table_view(table_key, frame, sort_by, filter_query)
+    page_count = max(-(-len(rows) // page_size), 1)
+    # Stay in range when a filter shrinks the table
+    page_current = min(page_current or 0, page_count - 1)
+    start = page_current * page_size
+    phase("records")
+    records = table_records(frame, rows[start:start + page_size])
+    count(rows=len(records))
+    return records, page_count, page_current, []
   
-@app.callback(  
+@callback(  
     Output('comparison-card', 'children'),  
-    Input('main-table', 'selected_rows'),  
-    State('main-table', 'data'),  
+    Input('main-table', 'selected_row_ids'),  
+    State('table-key', 'data'),  
     State('compare-columns', 'value')  
 )  
-def display_similarity(selected_rows, table_data, compare_cols):  
-    if not selected_rows or not table_data or not compare_cols:  
+@instrumented
+def display_similarity(selected_row_ids, table_key, compare_cols):  
+    frame = get_table(table_key)
+    if not selected_row_ids or frame is None or not compare_cols:  
         return ""  
-    df = pd.DataFrame(table_data)  
-    row = df.iloc[selected_rows[0]]  
+    row = table_row(frame, selected_row_ids[0])  
     cards = []  
     name1 = row.get('Name_1', row.get('ID_1', ''))  
     name2 = row.get('Name_2', row.get('ID_2', ''))  
     usage_1 = None  
     usage_2 = None  
-    for col in df.columns:  
+    for col in frame.columns:  
         if col.endswith('_1') and isinstance(row[col], (int, float)):  
             usage_1 = row[col]  
         if col.endswith('_2') and isinstance(row[col], (int, float)):  
@@ -519,20 +974,11 @@ def display_similarity(selected_rows, table_data, compare_cols):
         shared_col = f"{col} | Shared in both"  
         unique1_col = f"{col} | Unique to ID 1"  
         unique2_col = f"{col} | Unique to ID 2"  
-        shared = row.get(shared_col, "")  
-        unique_1 = row.get(unique1_col, "")  
-        unique_2 = row.get(unique2_col, "")  
-    
-        def to_list(s):  
-            if pd.isnull(s) or not s: return []  
-            items = []  
-            for part in s.split(';'):  
-                items.extend(x.strip() for x in part.split(','))  
-            return [x for x in items if x]  
-        
-        shared_list = to_list(shared)  
-        uniq1_list = to_list(unique_1)  
-        uniq2_list = to_list(unique_2)  
+        lists = row_token_lists(frame, selected_row_ids[0], col) if shared_col in frame.columns else None
+        if lists is None:
+            # Tables without a recorded source: the engine joins tokens with ", ", so split on it
+            lists = [row[c].split(", ") if row.get(c) else [] for c in (shared_col, unique1_col, unique2_col)]
+        shared_list, uniq1_list, uniq2_list = lists
         
         # >>> Here is where we add counts!  
         cards.append(html.Div([  
@@ -554,5 +1000,36 @@ def display_similarity(selected_rows, table_data, compare_cols):
         ], style={'marginTop': 30, 'marginBottom': 30}))  
     return html.Div(cards)  
   
+def create_app():
+    # The Dash app: layout, routes and callbacks. Caches and stores are module state, shared by
+    # every app in a process; under gunicorn --preload the workers fork from the master's, and
+    # locks (see LRUCache) and the job cache's connection are renewed in each child
+    import dash_bootstrap_components as dbc
+    app = dash.Dash(__name__, suppress_callback_exceptions=True, external_stylesheets=[dbc.themes.LUX],
+                    background_callback_manager=dash.DiskcacheManager(job_cache()))
+    app.layout = serve_layout
+    app.server.add_url_rule('/metrics', view_func=serve_metrics)
+    app.server.add_url_rule('/upload', view_func=receive_upload, methods=['POST'])
+    app.server.add_url_rule('/downloads/<name>', view_func=serve_download)
+    upload_js = UPLOAD_JS % app.get_relative_path('/upload')
+    for upload_id, key_id, error_id in [('upload-pairs', 'pairs-upload-key', 'pairs-upload-error'),
+                                        ('upload-lookup', 'lookup-upload-key', 'lookup-upload-error'),
+                                        ('upload-id-list', 'id-list-key', 'id-list-error'),
+                                        ('upload-block-meta', 'block-meta-key', 'block-meta-error')]:
+        app.clientside_callback(upload_js, Output(key_id, 'data'), Output(error_id, 'data'),
+                                Input(upload_id, 'contents'), State(upload_id, 'filename'))
+    for args, kwargs, fn in _callbacks:
+        app.callback(*args, **kwargs)(fn)
+    return app
+
+def __getattr__(name):
+    # `app` and `server` (for gunicorn app:server) are built on first access
+    global app, server
+    if name in ('app', 'server'):
+        app = create_app()
+        server = app.server
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+  
 if __name__ == '__main__':  
-    app.run_server(debug=True)  
\ No newline at end of file
+    create_app().run(debug=True)  
\ No newline at end of file
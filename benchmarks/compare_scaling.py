@@ -0,0 +1,52 @@
+# Time compare_token_sets on synthetic pairs for a range of COMPARE_WORKERS values.
+# Run from the repository root: python benchmarks/compare_scaling.py --pairs 4000000 --workers 1 2 4 8 16
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import numpy as np
+import pipeline
+import synthetic
+
+
+def synthetic_index(n_ids, vocab_size, tokens_per_id, skew, seed):
+    # Token index over n_ids synthetic metadata values
+    values = synthetic.token_values(n_ids, vocab_size, tokens_per_id, skew, np.random.default_rng(seed))
+    return pipeline.tokenize_column(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the comparison stage for several worker counts")
+    parser.add_argument('--ids', type=int, default=100000)
+    parser.add_argument('--pairs', type=int, default=2000000)
+    parser.add_argument('--vocab', type=int, default=20000)
+    parser.add_argument('--tokens', type=float, default=8, help="mean tokens per ID")
+    parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of token frequencies")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    index = synthetic_index(args.ids, args.vocab, args.tokens, args.skew, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    pos1 = rng.integers(0, args.ids, args.pairs)
+    pos2 = rng.integers(0, args.ids, args.pairs)
+    print(f"{args.pairs:,} pairs over {args.ids:,} IDs, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8} {'efficiency':>11}")
+    baseline = None
+    for workers in args.workers:
+        best = min(timed(index, pos1, pos2, workers) for _ in range(args.repeat))
+        baseline = baseline or best * args.workers[0]
+        speedup = baseline / best
+        print(f"{workers:>8} {best:>9.2f} {speedup:>8.2f} {speedup / workers:>11.0%}")
+
+
+def timed(index, pos1, pos2, workers):
+    start = time.perf_counter()
+    pipeline.compare_token_sets(index, pos1, pos2, workers=workers)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    main()
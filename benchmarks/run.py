@@ -0,0 +1,241 @@
+# Time each stage of the app on synthetic data by calling the callback functions directly (no
+# browser), plus the batch pipeline, and save seconds, rows, output bytes and peak memory per stage as JSON so runs can be
+# compared between versions:
+#   python benchmarks/run.py --ids 100000 --pairs 1000000 --output before.json
+#   python benchmarks/run.py --ids 100000 --pairs 1000000 --baseline before.json
+# Each stage runs in a fresh forked process (where fork is available) so its peak memory is its own.
+import argparse, base64, datetime, json, multiprocessing, os, platform, resource, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import synthetic
+
+STAGES = ['upload', 'parse', 'make_pairs', 'make_pairs_blocked', 'make_pairs_minhash', 'build', 'rebuild',
+          'build_repeat', 'page', 'display_similarity', 'export', 'export_repeat', 'batch']
+
+
+def rss_bytes():
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+def peak_rss_bytes(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(stage, setup=None):
+    # Run setup() untimed, then stage(); returns stage's (result, record). stage returns
+    # (result, rows, bytes_out)
+    def run():
+        if setup:
+            setup()
+        start_rss = rss_bytes()
+        start = time.perf_counter()
+        result, rows, bytes_out = stage()
+        seconds = time.perf_counter() - start
+        return result, {
+            'seconds': round(seconds, 4),
+            'rows': rows,
+            'bytes_out': bytes_out,
+            'peak_rss_mb': round(peak_rss_bytes() / 2**20, 1),
+            'rss_delta_mb': round((peak_rss_bytes() - start_rss) / 2**20, 1),
+            'workers_peak_rss_mb': round(peak_rss_bytes(resource.RUSAGE_CHILDREN) / 2**20, 1),
+        }
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return run()
+    context = multiprocessing.get_context('fork')
+    receive, send = context.Pipe(duplex=False)
+    process = context.Process(target=lambda: send.send(run()))
+    process.start()
+    send.close()
+    try:
+        output = receive.recv()
+    except EOFError:
+        output = None
+    process.join()
+    if output is None:
+        raise RuntimeError(f"Benchmark stage failed (exit code {process.exitcode})")
+    return output
+
+
+def generated_bytes(output, download_dir):
+    # Size of a file returned by send_generated_file, inline or as a /downloads link
+    data, status = output
+    if isinstance(data, dict):
+        return len(base64.b64decode(data['content'])) if data.get('base64') else len(data['content'])
+    href = getattr(status, 'href', None)
+    return os.path.getsize(os.path.join(download_dir, href.rsplit('/', 1)[1])) if href else 0
+
+
+class Progress:
+    # set_progress stand-in that keeps the last message, to read back how many rows were written
+    def __init__(self):
+        self.last = None
+
+    def __call__(self, value):
+        self.last = value
+
+    def written(self):
+        message = self.last[-1] if isinstance(self.last, tuple) else self.last
+        return int(message.split()[1].replace(',', '')) if message else 0
+
+
+def run_stages(app, pipeline, args, workdir):
+    pairs, lookup = synthetic.synthetic_tables(args.ids, args.pairs, args.vocab, args.tokens, args.skew, args.missing, args.seed)
+    paths = {
+        'pairs': synthetic.write_table(pairs, os.path.join(workdir, f"pairs.{args.format}")),
+        'lookup': synthetic.write_table(lookup, os.path.join(workdir, f"lookup.{args.format}")),
+        'ids': synthetic.write_table(lookup[['ID']].head(args.pair_ids), os.path.join(workdir, f"ids.{args.format}")),
+    }
+    compare_cols = ['Meta', 'Tags']
+    display_cols = ['ID_1', 'ID_2', 'Name_1', 'Name_2', 'Usage_1', 'Usage_2', 'Similarity/Score']
+    results = {}
+
+    def record(name, stage, setup=None):
+        if name in args.skip or (args.stages and name not in args.stages):
+            return None
+        runs = [measure(stage, setup) for _ in range(args.repeat)]
+        best = min((r[1] for r in runs), key=lambda r: r['seconds'])
+        results[name] = {**best, 'peak_rss_mb': max(r[1]['peak_rss_mb'] for r in runs)}
+        print(f"{name:<20} {best['seconds']:>9.3f}s {best['rows']:>12,} rows {results[name]['peak_rss_mb']:>9.1f} MB peak", flush=True)
+        return runs[-1][0]
+
+    keys = {}
+    def upload():
+        for name, path in paths.items():
+            with open(path, 'rb') as f:
+                keys[name] = pipeline.save_upload(f, os.path.basename(path))
+        return dict(keys), len(pairs) + len(lookup), sum(os.path.getsize(p) for p in paths.values())
+    # Uploads are stored on disk, so the later stages (and their processes) can use the keys
+    keys.update(record('upload', upload) or upload()[0])
+
+    def parse():
+        frames = [pipeline.parse_contents(pipeline.upload_path(keys[name]), keys[name]) for name in ('pairs', 'lookup')]
+        return None, sum(len(f) for f in frames), sum(int(f.memory_usage(deep=True).sum()) for f in frames)
+    record('parse', parse)
+
+    def make_pairs(*blocking):
+        def stage():
+            progress = Progress()
+            output = app.make_pairs(progress, 1, keys['ids'], args.pairs_format, *blocking)
+            return None, progress.written(), generated_bytes(output, app.DOWNLOAD_DIR)
+        return stage
+    record('make_pairs', make_pairs(None, None, None, 1, None))
+    record('make_pairs_blocked', make_pairs(keys['lookup'], 'ID', ['Tags'], 1, None))
+    record('make_pairs_minhash', make_pairs(keys['lookup'], 'ID', ['Meta'], 1, None, 'minhash', args.threshold))
+
+    def build(compare):
+        def stage():
+            progress = Progress()
+            table_key = app.build_main_table(progress, 1, 'ID1', 'ID2', 'Score', 'ID', 'Name', 'Usage', 'Meta', compare,
+                                             display_cols, keys['pairs'], keys['lookup'])[0]
+            table = pipeline.get_table(table_key)
+            return table_key, len(table), int(table.memory_usage(deep=True).sum())
+        return stage
+    table_key = record('build', build(compare_cols))
+    # Adding a compare column reuses the stored join and the first column's results
+    record('rebuild', build(compare_cols + ['Name']), setup=lambda: build(compare_cols)())
+    if table_key is None:
+        table_key = measure(build(compare_cols))[0]
+    # A new process asking for a table already built: everything comes from the result store
+    record('build_repeat', build(compare_cols))
+
+    def load_table():
+        pipeline.get_table(table_key)
+
+    def page():
+        records = app.update_table_page(table_key, 0, 50, [{'column_id': 'Similarity/Score', 'direction': 'desc'}],
+                                        '{Meta | Shared in both} contains tok1')[0]
+        return None, len(records), len(json.dumps(records))
+    record('page', page, setup=load_table)
+
+    def display_similarity():
+        import plotly.io.json
+        card = app.display_similarity([0], table_key, compare_cols)
+        return None, 1, len(plotly.io.json.to_json_plotly(card))
+    record('display_similarity', display_similarity, setup=load_table)
+
+    def export():
+        progress = Progress()
+        output = app.export_to_excel(progress, 1, table_key, compare_cols)
+        return None, progress.written(), generated_bytes(output, app.DOWNLOAD_DIR)
+    record('export', export, setup=load_table)
+    # Exporting the same table again copies the stored workbook
+    record('export_repeat', export, setup=lambda: (load_table(), export()))
+
+    def batch():
+        # The whole build and a Parquet export in one streamed pass, as a nightly job runs it
+        output = os.path.join(workdir, "batch.parquet")
+        written = pipeline.compare_files(paths['pairs'], paths['lookup'], output, 'ID1', 'ID2', 'ID', 'Score', 'Name',
+                                         'Usage', 'Meta', compare_cols, chunk_rows=args.chunk_rows)
+        return None, written, os.path.getsize(output)
+    record('batch', batch)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pairwise comparison stages on synthetic data")
+    parser.add_argument('--ids', type=int, default=20000, help="IDs in the metadata table")
+    parser.add_argument('--pairs', type=int, default=200000, help="rows in the pairs table")
+    parser.add_argument('--vocab', type=int, default=5000, help="token vocabulary size")
+    parser.add_argument('--tokens', type=float, default=8, help="mean tokens per ID")
+    parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of token frequencies")
+    parser.add_argument('--missing', type=float, default=0.01, help="fraction of pair IDs not in the metadata")
+    parser.add_argument('--pair-ids', type=int, default=2000, help="IDs in the list given to the pair generator")
+    parser.add_argument('--threshold', type=float, default=0.5, help="Jaccard threshold for MinHash pair generation")
+    parser.add_argument('--format', choices=['csv', 'parquet', 'xlsx'], default='csv', help="format of the input files")
+    parser.add_argument('--pairs-format', choices=['csv.gz', 'parquet', 'xlsx'], default='parquet', help="format of generated pairs")
+    parser.add_argument('--chunk-rows', type=int, help="pairs per chunk in the batch stage")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="runs per stage; the fastest is reported")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, help="only run these stages")
+    parser.add_argument('--skip', nargs='+', choices=STAGES, default=[], help="stages to leave out")
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    # Uploads, results and downloads go to a scratch directory, set before the app reads its config
+    with tempfile.TemporaryDirectory(prefix="pairwise-bench-") as workdir:
+        for var in ('UPLOAD_DIR', 'RESULTS_DIR', 'DOWNLOAD_DIR', 'BACKGROUND_CACHE_DIR'):
+            os.environ[var] = os.path.join(workdir, var.lower())
+        # Per-call log lines would interleave with the results
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        import app, pipeline
+        stages = run_stages(app, pipeline, args, workdir)
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'stages': stages,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nAgainst {args.baseline} (commit {baseline.get('commit')}):")
+        for name, result in stages.items():
+            before = baseline['stages'].get(name)
+            if before and before['seconds']:
+                print(f"{name:<20} {result['seconds'] / before['seconds']:>6.2f}x time "
+                      f"{result['peak_rss_mb'] / max(before['peak_rss_mb'], 0.1):>6.2f}x peak memory")
+
+
+if __name__ == '__main__':
+    main()
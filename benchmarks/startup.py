@@ -0,0 +1,110 @@
+# Time and measure the memory of starting the app, each step in a fresh interpreter so nothing is
+# already imported: importing pipeline (what batch runs and comparison workers load), importing
+# app, building it with create_app, and serving the first page. Results can be saved and compared
+# like benchmarks/run.py:
+#   python benchmarks/startup.py --output before.json
+#   python benchmarks/startup.py --baseline before.json --importtime 15
+import argparse, datetime, json, os, platform, subprocess, sys, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run import git_commit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Each step runs everything before it untimed, then times its own statement
+STEPS = {
+    'import_pipeline': ([], "import pipeline"),
+    'import_app': ([], "import app"),
+    'create_app': (["import app"], "dash_app = app.create_app()"),
+    'first_page': (["import app", "dash_app = app.create_app()", "client = dash_app.server.test_client()"],
+                   "[client.get(path) for path in ('/', '/_dash-layout', '/_dash-dependencies')]"),
+}
+
+PROBE = """
+import json, sys, time, psutil
+sys.path.insert(0, {root!r})
+process = psutil.Process()
+{setup}
+modules, rss = len(sys.modules), process.memory_info().rss
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': round(seconds, 4), 'rss_mb': round(process.memory_info().rss / 2**20, 1),
+                  'rss_delta_mb': round((process.memory_info().rss - rss) / 2**20, 1),
+                  'modules': len(sys.modules), 'new_modules': len(sys.modules) - modules}}))
+"""
+
+
+def run_step(name, env):
+    setup, statement = STEPS[name]
+    code = PROBE.format(root=ROOT, setup='\n'.join(setup), statement=statement)
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True)
+    if output.returncode:
+        raise RuntimeError(f"Startup step {name} failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def import_times(module, env, top):
+    # The modules with the largest cumulative import time, from python -X importtime
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], env=env, cwd=ROOT,
+                            capture_output=True, text=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    # Only top-level entries (no indentation) and their direct children are worth reading
+    rows = [(us, name) for us, name in rows if len(name) - len(name.lstrip()) <= 3]
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app import and startup time and memory")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per step; the fastest is reported")
+    parser.add_argument('--steps', nargs='+', choices=list(STEPS), help="only run these steps")
+    parser.add_argument('--importtime', type=int, metavar='N', help="also list the N slowest imports of app")
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="pairwise-startup-") as workdir:
+        env = dict(os.environ, LOG_LEVEL='WARNING')
+        for var in ('UPLOAD_DIR', 'RESULTS_DIR', 'DOWNLOAD_DIR', 'BACKGROUND_CACHE_DIR'):
+            env[var] = os.path.join(workdir, var.lower())
+        steps = {}
+        for name in args.steps or STEPS:
+            runs = [run_step(name, env) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r['seconds'])
+            steps[name] = {**best, 'rss_mb': max(r['rss_mb'] for r in runs)}
+            print(f"{name:<16} {best['seconds']:>8.3f}s {steps[name]['rss_mb']:>8.1f} MB RSS "
+                  f"{best['new_modules']:>6} modules", flush=True)
+        if args.importtime:
+            print("\nSlowest imports of app (cumulative):")
+            for us, module in import_times('app', env, args.importtime):
+                print(f"{us / 1e6:>8.3f}s {module}")
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'repeat': args.repeat},
+        'steps': steps,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nAgainst {args.baseline} (commit {baseline.get('commit')}):")
+        for name, result in steps.items():
+            before = baseline['steps'].get(name)
+            if before and before['seconds']:
+                print(f"{name:<16} {result['seconds'] / before['seconds']:>6.2f}x time "
+                      f"{result['rss_mb'] / max(before['rss_mb'], 0.1):>6.2f}x RSS")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Synthetic inputs for the benchmarks: a pairs table (ID1, ID2, Score), a metadata table
+# (ID, Name, Usage, Meta, Tags) and an ID list, with control over the number of IDs and pairs,
+# the token vocabulary, tokens per ID and how skewed token frequencies are.
+# python benchmarks/synthetic.py --ids 100000 --pairs 1000000 --format parquet --out /tmp/bench
+import argparse, os
+
+import numpy as np
+import pandas as pd
+
+
+def token_values(n_ids, vocab_size, tokens_per_id, skew, rng):
+    # Comma-separated token strings, Poisson(tokens_per_id) tokens each; token ranks follow a
+    # Zipf-like law with exponent skew (0 is uniform), so a few tokens are shared by many IDs
+    counts = rng.poisson(tokens_per_id, n_ids)
+    weights = 1.0 / np.arange(1, vocab_size + 1) ** skew
+    tokens = np.char.add("tok", rng.choice(vocab_size, counts.sum(), p=weights / weights.sum()).astype(str))
+    return np.array([", ".join(row) for row in np.split(tokens, np.cumsum(counts)[:-1])], dtype=object)
+
+
+def synthetic_tables(n_ids=10000, n_pairs=100000, vocab_size=5000, tokens_per_id=8, skew=1.0, missing=0.01, seed=0):
+    # (pairs, lookup) frames shaped like the app's inputs. Pairs are grouped by ID1 as a
+    # candidate generator would write them; `missing` of the pair IDs are not in the lookup.
+    # Tags is a second metadata column with a tenth of the vocabulary and 3 tokens per ID.
+    rng = np.random.default_rng(seed)
+    ids = np.char.add("ID", np.arange(n_ids).astype(str)).astype(object)
+    lookup = pd.DataFrame({
+        'ID': ids,
+        'Name': np.char.add("name ", np.arange(n_ids).astype(str)).astype(object),
+        'Usage': rng.integers(0, 1000, n_ids),
+        'Meta': token_values(n_ids, vocab_size, tokens_per_id, skew, rng),
+        'Tags': token_values(n_ids, max(vocab_size // 10, 1), 3, skew, rng),
+    })
+    first = np.sort(rng.integers(0, n_ids, n_pairs))
+    second = (first + rng.integers(1, max(n_ids, 2), n_pairs)) % n_ids
+    pairs = pd.DataFrame({'ID1': ids[first], 'ID2': ids[second], 'Score': rng.random(n_pairs).round(4)})
+    unknown = rng.random(n_pairs) < missing
+    pairs.loc[unknown, 'ID2'] = np.char.add("X", np.flatnonzero(unknown).astype(str)).astype(object)
+    return pairs, lookup
+
+
+def write_table(frame, path):
+    # Write in the format given by the file extension, as the app reads it back
+    if path.endswith('.csv'):
+        frame.to_csv(path, index=False)
+    elif path.endswith('.parquet'):
+        frame.to_parquet(path, index=False)
+    elif path.endswith('.xlsx'):
+        frame.to_excel(path, index=False)
+    else:
+        raise ValueError(f"Unsupported format: {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic pairs, metadata and ID list files")
+    parser.add_argument('--ids', type=int, default=10000)
+    parser.add_argument('--pairs', type=int, default=100000)
+    parser.add_argument('--vocab', type=int, default=5000)
+    parser.add_argument('--tokens', type=float, default=8, help="mean tokens per ID")
+    parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of token frequencies")
+    parser.add_argument('--missing', type=float, default=0.01, help="fraction of pair IDs not in the metadata")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=['csv', 'parquet', 'xlsx'], default='csv')
+    parser.add_argument('--out', default='.')
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    pairs, lookup = synthetic_tables(args.ids, args.pairs, args.vocab, args.tokens, args.skew, args.missing, args.seed)
+    for name, frame in (("pairs", pairs), ("lookup", lookup), ("ids", lookup[['ID']])):
+        print(write_table(frame, os.path.join(args.out, f"{name}.{args.format}")))
+
+
+if __name__ == '__main__':
+    main()
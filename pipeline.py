@@ -0,0 +1,1553 @@
+# The comparison engine behind the Dash app: reading inputs, the lookup and token indexes,
+# scoring, joining, comparing metadata columns, generating pairs and writing outputs. Nothing
+# here imports Dash, so batch jobs can run the same steps from the command line:
+#   python pipeline.py compare --pairs pairs.csv --metadata meta.csv --id1 ID1 --id2 ID2 --id ID --compare Meta --output merged.parquet
+#   python pipeline.py pairs --ids ids.csv --output pairs.parquet
+import pandas as pd
+import numpy as np
+import argparse, base64, contextlib, contextvars, gzip, hashlib, io, json, os, re, shutil, sys, tempfile, threading, time
+import importlib.util
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Steps report their phase and the rows they processed to the Dash callback running them, if
+# any (see instrumented in app.py); outside a callback these are no-ops
+class CallbackTimer:
+    # One callback call's measurements. Time is attributed to the current phase ("run" until
+    # the callback names one); phase(name) ends it and starts the next
+    def __init__(self, name, bytes_in=0):
+        self.name = name
+        self.phases = {}
+        self.current = "run"
+        self.started = self.last = time.perf_counter()
+        self.rows = 0
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+
+    def phase(self, name):
+        now = time.perf_counter()
+        if self.current is not None:
+            self.phases[self.current] = self.phases.get(self.current, 0.0) + now - self.last
+        self.current, self.last = name, now
+
+    @property
+    def seconds(self):
+        return self.last - self.started
+
+_callback_timer = contextvars.ContextVar('callback_timer', default=None)
+
+def phase(name):
+    # Start a named phase of the running callback; a no-op outside instrumented calls
+    timer = _callback_timer.get()
+    if timer is not None:
+        timer.phase(name)
+
+def count(rows=0, bytes_in=0):
+    timer = _callback_timer.get()
+    if timer is not None:
+        timer.rows += int(rows)
+        timer.bytes_in += int(bytes_in)
+
+
+# Upper bound on memory held by parsed uploads (MB)
+UPLOAD_CACHE_MB = int(os.getenv("UPLOAD_CACHE_MB", "2048"))
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+class LRUCache:
+    # Thread-safe least-recently-used cache bounded by the total size of its values
+    def __init__(self, max_bytes, sizeof=frame_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._items = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        # A fork (background jobs) can happen while another thread holds the lock
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self._nbytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self._nbytes += size
+            # Evict oldest entries, but always keep the one just added
+            while self._nbytes > self.max_bytes and len(self._items) > 1:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._nbytes -= old_size
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def memory(self):
+        # Bytes held by the cached values, also for caches bounded by entry count
+        with self._lock:
+            values = [value for value, _ in self._items.values()]
+        return sum(frame_nbytes(v) if isinstance(v, pd.DataFrame) else v.nbytes for v in values)
+
+_upload_cache = LRUCache(UPLOAD_CACHE_MB * 1024 * 1024)
+_preview_cache = LRUCache(64 * 1024 * 1024)
+# Raw uploads are streamed here and named by content hash, so any worker can re-parse them
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "pairwise-uploads"))
+UPLOAD_MAX_AGE_HOURS = float(os.getenv("UPLOAD_MAX_AGE_HOURS", "24"))
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "2048"))
+UPLOAD_EXTENSIONS = ('.csv', '.xls', '.xlsx', '.parquet', '.feather', '.arrow')
+# Faster readers are used when installed: pyarrow's multithreaded CSV parser and calamine for Excel
+CSV_ENGINE = os.getenv("CSV_ENGINE") or ('pyarrow' if importlib.util.find_spec('pyarrow') else 'c')
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE") or ('calamine' if importlib.util.find_spec('python_calamine') else None)
+# Rows read to list an upload's columns and guess their types before anything is selected
+PREVIEW_ROWS = int(os.getenv("PREVIEW_ROWS", "1000"))
+# Upload and table keys come back from the browser; only these shapes map to files
+_UPLOAD_KEY = re.compile(r'[0-9a-f]{40}\.[a-z]+')
+_RESULT_KEY = re.compile(r'[0-9a-f]{40}')
+
+def prune_dir(path, max_age_hours):
+    cutoff = time.time() - max_age_hours * 3600
+    for name in os.listdir(path):
+        file_path = os.path.join(path, name)
+        try:
+            if os.path.getmtime(file_path) < cutoff:
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path)
+                else:
+                    os.remove(file_path)
+        except OSError:
+            pass
+
+def parse_contents(contents, filename, columns=None, nrows=None):  
+    # contents is a dcc.Upload data URL, raw bytes, or the path of a stored upload. Only
+    # `columns` are read when given; `nrows` reads just the first rows, for previews
+    if isinstance(contents, str) and contents.startswith('data:'):
+        contents = io.BytesIO(base64.b64decode(contents.split(',', 1)[1]))
+    elif isinstance(contents, (bytes, bytearray)):
+        contents = io.BytesIO(contents)
+    name = filename.lower()
+    try:  
+        if name.endswith('.csv'):  
+            return read_csv_fast(contents, columns, nrows)
+        elif name.endswith(('.xls', '.xlsx')):  
+            return read_excel_fast(contents, columns, nrows)
+        elif name.endswith('.parquet'):
+            return read_parquet(contents, columns, nrows)
+        elif name.endswith(('.feather', '.arrow')):
+            return read_arrow(contents, columns, nrows)
+    except Exception as e:  
+        print(f"Error parsing {filename}: {e}")  
+    return pd.DataFrame()  
+
+def read_csv_fast(source, columns=None, nrows=None):
+    # The pyarrow reader can't stop after nrows, so with it previews use the C engine
+    engine = 'c' if CSV_ENGINE == 'pyarrow' else CSV_ENGINE
+    if CSV_ENGINE != 'pyarrow' or nrows is not None:
+        return pd.read_csv(source, usecols=columns, nrows=nrows, engine=engine)
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    try:
+        # pyarrow turns ISO date/time text into dates; keep those columns as the text in the
+        # file, like the C engine does. Types are sniffed from the first block only
+        with pa_csv.open_csv(source) as reader:
+            dated = {f.name: pa.string() for f in reader.schema
+                     if pa.types.is_date(f.type) or pa.types.is_timestamp(f.type) or pa.types.is_time(f.type)}
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        table = pa_csv.read_csv(source, convert_options=pa_csv.ConvertOptions(
+            include_columns=columns, column_types=dated, strings_can_be_null=True))
+        if any(pa.types.is_binary(f.type) for f in table.schema):
+            raise ValueError("not UTF-8")
+        return table.to_pandas()
+    except Exception:
+        # Malformed rows or encodings pyarrow rejects; the C engine is more forgiving
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return pd.read_csv(source, usecols=columns, engine=engine)
+
+def read_excel_fast(source, columns=None, nrows=None):
+    try:
+        return pd.read_excel(source, usecols=columns, nrows=nrows, engine=EXCEL_ENGINE)
+    except ImportError:
+        # EXCEL_ENGINE set to a reader that isn't installed
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return pd.read_excel(source, usecols=columns, nrows=nrows)
+
+def read_parquet(source, columns=None, nrows=None):
+    if nrows is None:
+        return pd.read_parquet(source, columns=columns)
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(source)
+    batch = next(parquet_file.iter_batches(batch_size=nrows, columns=columns), None)
+    if batch is None:
+        return parquet_file.schema_arrow.empty_table().to_pandas()
+    return batch.to_pandas()
+
+def read_arrow(source, columns=None, nrows=None):
+    # Feather v2 / Arrow IPC file format, falling back to the IPC stream format
+    import pyarrow as pa
+    try:
+        reader = pa.ipc.open_file(source)
+        if nrows is not None and reader.num_record_batches:
+            table = pa.Table.from_batches([reader.get_batch(0)])
+        else:
+            table = reader.read_all()
+    except pa.ArrowInvalid:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        with pa.ipc.open_stream(source) as reader:
+            table = reader.read_all()
+    if columns:
+        table = table.select(columns)
+    if nrows is not None:
+        table = table.slice(0, nrows)
+    return table.to_pandas()
+
+def upload_key(digest, filename):
+    # Content hash plus extension, since the extension decides how the bytes are parsed
+    ext = os.path.splitext(filename)[1].lower()
+    return digest[:40] + ext
+
+def save_upload(stream, filename):
+    # Stream the request body to UPLOAD_DIR while hashing it; returns the upload key
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    prune_dir(UPLOAD_DIR, UPLOAD_MAX_AGE_HOURS)
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix='.part', delete=False) as tmp:
+        try:
+            while True:
+                chunk = stream.read(1 << 20)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_MB * 1024 * 1024:
+                    raise ValueError(f"{filename} is larger than {MAX_UPLOAD_MB} MB")
+                digest.update(chunk)
+                tmp.write(chunk)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    key = upload_key(digest.hexdigest(), filename)
+    os.replace(tmp.name, os.path.join(UPLOAD_DIR, key))
+    return key
+
+def upload_path(key):
+    if not key or not _UPLOAD_KEY.fullmatch(key):
+        return None
+    path = os.path.join(UPLOAD_DIR, key)
+    return path if os.path.exists(path) else None
+
+# Uploads that take a full parse to read (CSV text, Excel workbooks) are kept parsed in the
+# result store (see RESULTS_DIR), so the same file uploaded again is not parsed again. Parquet
+# and Arrow uploads are already columnar and are read directly
+_STORED_UPLOADS = ('.csv', '.xls', '.xlsx')
+
+def read_upload(key, columns=None, nrows=None):
+    def parse():
+        path = upload_path(key)
+        return parse_contents(path, key, columns, nrows) if path else pd.DataFrame()
+    if not key or not key.endswith(_STORED_UPLOADS):
+        return parse()
+    return stored_frame(result_key("upload", key, columns, nrows), parse)
+
+def get_upload(key, columns=None):
+    # Parsed upload by key, read from the result store or UPLOAD_DIR on a miss (evicted, or
+    # uploaded to another worker). With `columns`, only those columns are read and cached
+    columns = list(dict.fromkeys(c for c in columns if c)) if columns is not None else None
+    cache_key = (key, tuple(columns) if columns is not None else None)
+    df = _upload_cache.get(cache_key)
+    if df is None:
+        df = read_upload(key, columns)
+        if df.empty:
+            return df
+        _upload_cache.put(cache_key, df)
+    return df
+
+def upload_columns(key, columns):
+    # The requested columns that exist in the upload, for projected reads
+    available = upload_preview(key).columns
+    return [c for c in columns if c in available]
+
+def upload_preview(key):
+    # First PREVIEW_ROWS rows of an upload: enough for column pickers and type guesses,
+    # without reading the whole file before the user says which columns matter
+    df = _preview_cache.get(key)
+    if df is None:
+        df = read_upload(key, nrows=PREVIEW_ROWS)
+        if df.empty:
+            return df
+        _preview_cache.put(key, df)
+    return df
+
+def parse_metadata_string(s):  
+    if pd.isnull(s):  
+        return set()  
+    return set(a.strip() for a in s.split(',') if a.strip())  
+
+# Pairs compared per NumPy batch; bounds the temporary token arrays
+COMPARE_CHUNK_ROWS = int(os.getenv("COMPARE_CHUNK_ROWS", "500000"))
+
+def tokenize_column(values, numeric=False):
+    # Tokenize each distinct value once, with the same semantics as parse_metadata_string
+    # (or a single str(value) token for numeric columns). Returns (codes, indptr, tokens, vocab):
+    # codes maps each row to its distinct value (-1 when null), indptr/tokens hold the sorted
+    # token ids of each distinct value, and vocab is sorted so token id order is string order.
+    codes, uniques = pd.factorize(pd.Series(values).reset_index(drop=True))
+    uniques = pd.Series(uniques, dtype=object)
+    if numeric:
+        exploded = uniques.map(str)
+    else:
+        exploded = uniques.map(str).str.split(',').explode().str.strip()
+    exploded = exploded[exploded.notna() & (exploded != "")]
+    owner = exploded.index.to_numpy(dtype=np.int64)
+    tok, vocab = pd.factorize(exploded.to_numpy(dtype=object), sort=True)
+    order = np.lexsort((tok, owner))
+    owner, tok = owner[order], tok[order]
+    keep = np.ones(len(tok), dtype=bool)
+    keep[1:] = (owner[1:] != owner[:-1]) | (tok[1:] != tok[:-1])
+    owner, tok = owner[keep], tok[keep]
+    indptr = np.zeros(len(uniques) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owner, minlength=len(uniques)), out=indptr[1:])
+    return codes, indptr, tok.astype(np.int64), np.asarray(vocab, dtype=object)
+
+def _pair_token_keys(values, indptr, tokens, n_vocab):
+    # Expand each pair's token list into sorted keys pair_no * n_vocab + token_id
+    valid = values >= 0
+    if not valid.any():
+        return np.empty(0, dtype=np.int64)
+    safe = np.where(valid, values, 0)
+    lengths = np.where(valid, indptr[safe + 1] - indptr[safe], 0)
+    pair_no = np.repeat(np.arange(len(values), dtype=np.int64), lengths)
+    offsets = np.arange(int(lengths.sum()), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return pair_no * n_vocab + tokens[np.repeat(indptr[safe], lengths) + offsets]
+
+def _join_token_keys(keys, n_pairs, vocab):
+    # ", ".join of each pair's sorted tokens; pairs without tokens get ""
+    out = np.full(n_pairs, "", dtype=object)
+    if len(keys) == 0:
+        return out
+    pair_no, tok = np.divmod(keys, len(vocab))
+    starts = np.flatnonzero(np.r_[True, pair_no[1:] != pair_no[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    parts = (vocab + ", ")[tok]
+    parts[ends] = vocab[tok[ends]]
+    out[pair_no[starts]] = np.add.reduceat(parts, starts)
+    return out
+
+def _compare_chunk(c1, c2, indptr, tokens, vocab):
+    # Shared / unique-to-1 / unique-to-2 strings for one batch of pairs' distinct-value codes
+    n_vocab = max(len(vocab), 1)
+    k1 = _pair_token_keys(c1, indptr, tokens, n_vocab)
+    k2 = _pair_token_keys(c2, indptr, tokens, n_vocab)
+    in2 = np.isin(k1, k2, assume_unique=True)
+    in1 = np.isin(k2, k1, assume_unique=True)
+    return tuple(_join_token_keys(keys, len(c1), vocab) for keys in (k1[in2], k1[~in2], k2[~in1]))
+
+# Worker processes for the comparison stage (1 compares in the calling process), and the
+# fewest pairs worth handing to a worker
+COMPARE_WORKERS = int(os.getenv("COMPARE_WORKERS") or min(os.cpu_count() or 1, 8))
+COMPARE_SHARD_MIN_ROWS = int(os.getenv("COMPARE_SHARD_MIN_ROWS", "50000"))
+# Workers per build in the app. Every running build job has its own pool, so a server can run
+# up to concurrent builds x BUILD_COMPARE_WORKERS comparison processes
+BUILD_COMPARE_WORKERS = int(os.getenv("BUILD_COMPARE_WORKERS") or COMPARE_WORKERS)
+# Token indexes shared with the workers. A cancelled build is killed before its pool can remove
+# them, so directories untouched for COMPARE_INDEX_MAX_AGE_HOURS are pruned by later pools
+COMPARE_INDEX_DIR = os.getenv("COMPARE_INDEX_DIR", os.path.join(tempfile.gettempdir(), "pairwise-index"))
+COMPARE_INDEX_MAX_AGE_HOURS = float(os.getenv("COMPARE_INDEX_MAX_AGE_HOURS", "24"))
+
+def share_token_index(indptr, tokens, vocab, path):
+    # Save the token index as .npy files the workers memory-map instead of receiving a pickled
+    # copy per task; the vocabulary is stored as one UTF-8 buffer plus offsets
+    encoded = [t.encode() for t in vocab]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in encoded], out=offsets[1:])
+    np.save(os.path.join(path, "indptr.npy"), indptr)
+    np.save(os.path.join(path, "tokens.npy"), tokens)
+    np.save(os.path.join(path, "vocab.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+
+# Token indexes memory-mapped by this worker process, by directory
+_shared_token_indexes = {}
+
+def _load_shared_token_index(path):
+    if path not in _shared_token_indexes:
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode='r')
+        blob, offsets = load("vocab.npy").tobytes(), load("offsets.npy")
+        vocab = np.array([blob[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)], dtype=object)
+        _shared_token_indexes[path] = (load("indptr.npy"), load("tokens.npy"), vocab)
+    return _shared_token_indexes[path]
+
+class ComparePool:
+    # Worker processes for compare_token_sets plus the token indexes shared with them. Kept open
+    # across calls, the workers start and each index is saved only once for a whole batch run
+    def __init__(self, workers=None):
+        self.workers = workers or COMPARE_WORKERS
+        os.makedirs(COMPARE_INDEX_DIR, exist_ok=True)
+        prune_dir(COMPARE_INDEX_DIR, COMPARE_INDEX_MAX_AGE_HOURS)
+        self._dir = tempfile.mkdtemp(dir=COMPARE_INDEX_DIR)
+        self._paths = {}
+        self._executor = None
+
+    def shared_path(self, indptr, tokens, vocab):
+        # Keyed by the tokens array, which is held here so its id can't be reused
+        if id(tokens) not in self._paths:
+            path = os.path.join(self._dir, str(len(self._paths)))
+            os.makedirs(path)
+            share_token_index(indptr, tokens, vocab, path)
+            self._paths[id(tokens)] = (path, tokens)
+        return self._paths[id(tokens)][0]
+
+    def map(self, fn, *iterables):
+        # Keeps a long batch run's directory from looking abandoned
+        os.utime(self._dir)
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # fork skips re-importing the app in each worker where it is available
+            context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+        return self._executor.map(fn, *iterables)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _text_series(values):
+    # Arrow-backed when pyarrow is installed: converted in the worker that built the strings,
+    # cheap to send back, and dictionary-encoded by compact_column without Python objects
+    if importlib.util.find_spec('pyarrow'):
+        return pd.Series(values, dtype='string[pyarrow]')
+    return pd.Series(values, dtype=object)
+
+def _compare_shard(path, c1, c2):
+    return tuple(_text_series(r) for r in _compare_chunk(c1, c2, *_load_shared_token_index(path)))
+
+def compare_token_sets(index, pos1, pos2, chunk_rows=None, workers=None, pool=None):
+    # Shared / unique-to-1 / unique-to-2 text Series for every pair, given lookup row positions
+    # of ID 1 and ID 2 (-1 when the ID is not in the lookup table). With more than one worker
+    # the pairs are split into shards compared by a process pool (pool, or one started for this
+    # call) and merged back in order.
+    codes, indptr, tokens, vocab = index
+    chunk_rows = chunk_rows or COMPARE_CHUNK_ROWS
+    workers = pool.workers if pool is not None else workers or COMPARE_WORKERS
+    v1 = np.where(pos1 >= 0, codes[pos1], -1) if len(codes) else np.full(len(pos1), -1)
+    v2 = np.where(pos2 >= 0, codes[pos2], -1) if len(codes) else np.full(len(pos2), -1)
+    shard_rows = min(chunk_rows, max(COMPARE_SHARD_MIN_ROWS, -(-len(v1) // workers)))
+    starts = range(0, len(v1), shard_rows if workers > 1 else chunk_rows)
+    if workers > 1 and len(starts) > 1:
+        with contextlib.nullcontext(pool) if pool is not None else ComparePool(min(workers, len(starts))) as shard_pool:
+            path = shard_pool.shared_path(indptr, tokens, vocab)
+            shards = list(shard_pool.map(_compare_shard, [path] * len(starts),
+                                         [v1[start:start + shard_rows] for start in starts],
+                                         [v2[start:start + shard_rows] for start in starts]))
+    else:
+        shards = [tuple(_text_series(r) for r in _compare_chunk(v1[start:start + chunk_rows], v2[start:start + chunk_rows], indptr, tokens, vocab))
+                  for start in starts]
+    if not shards:
+        return tuple(_text_series([]) for _ in range(3))
+    return tuple(pd.concat(r, ignore_index=True) for r in zip(*shards))
+
+# Set similarity scores offered in place of a score column from the pairs file
+SIMILARITY_METRICS = {'jaccard': 'Jaccard of metadata tokens', 'overlap': 'Overlap coefficient of metadata tokens'}
+
+def check_score_method(score_method, meta_col, columns=None):
+    # Similarity scores need the metadata column; never fall back to the pairs' score column
+    if score_method in SIMILARITY_METRICS and (not meta_col or (columns is not None and meta_col not in columns)):
+        raise ValueError(f"Scoring by {SIMILARITY_METRICS[score_method]} needs a metadata column of the lookup table")
+
+def _set_similarity(v1, v2, indptr, tokens, n_vocab, metric='jaccard', chunk_rows=None):
+    # Jaccard (|A & B| / |A | B|) or overlap (|A & B| / min(|A|, |B|)) of the token sets at
+    # CSR rows v1 and v2 (-1 for none); NaN when the denominator is 0
+    chunk_rows = chunk_rows or COMPARE_CHUNK_ROWS
+    sizes = np.diff(indptr)
+    n1 = np.where(v1 >= 0, sizes[np.maximum(v1, 0)], 0) if len(sizes) else np.zeros(len(v1), dtype=np.int64)
+    n2 = np.where(v2 >= 0, sizes[np.maximum(v2, 0)], 0) if len(sizes) else np.zeros(len(v2), dtype=np.int64)
+    shared = np.zeros(len(v1), dtype=np.int64)
+    for start in range(0, len(v1), chunk_rows):
+        c1, c2 = v1[start:start + chunk_rows], v2[start:start + chunk_rows]
+        k1 = _pair_token_keys(c1, indptr, tokens, n_vocab)
+        k2 = _pair_token_keys(c2, indptr, tokens, n_vocab)
+        shared[start:start + len(c1)] = np.bincount(k1[np.isin(k1, k2, assume_unique=True)] // n_vocab, minlength=len(c1))
+    denominator = np.minimum(n1, n2) if metric == 'overlap' else n1 + n2 - shared
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denominator > 0, shared / np.maximum(denominator, 1), np.nan)
+
+def token_set_similarity(index, pos1, pos2, metric='jaccard', chunk_rows=None):
+    # Set similarity of every pair's tokens, given lookup row positions as in compare_token_sets
+    codes, indptr, tokens, vocab = index
+    v1 = np.where(pos1 >= 0, codes[pos1], -1) if len(codes) else np.full(len(pos1), -1)
+    v2 = np.where(pos2 >= 0, codes[pos2], -1) if len(codes) else np.full(len(pos2), -1)
+    return _set_similarity(v1, v2, indptr, tokens, max(len(vocab), 1), metric, chunk_rows)
+
+def pair_token_lists(index, pos1, pos2):
+    # Shared / unique-to-1 / unique-to-2 token lists of a single pair, in the same order
+    # compare_token_sets joins them
+    codes, indptr, tokens, vocab = index
+    def row_tokens(pos):
+        code = codes[pos] if pos >= 0 else -1
+        return tokens[indptr[code]:indptr[code + 1]] if code >= 0 else tokens[:0]
+    t1, t2 = row_tokens(pos1), row_tokens(pos2)
+    return tuple(vocab[keys].tolist() for keys in (
+        np.intersect1d(t1, t2, assume_unique=True),
+        np.setdiff1d(t1, t2, assume_unique=True),
+        np.setdiff1d(t2, t1, assume_unique=True),
+    ))
+
+_TOKEN_ARRAYS = ("codes", "indptr", "tokens", "vocab")
+
+class LookupIndex:
+    # Lookup table IDs (last occurrence wins, as dict(zip(...)) did) plus the token index
+    # of each compare column, built the first time that column is compared. With a key (see
+    # get_lookup_index) both are kept in the result store and loaded from it when present.
+    # lookup_ids may be a function returning the IDs, called only when nothing is stored
+    def __init__(self, lookup_ids, key=None):
+        self.key = key
+        stored = load_arrays(key) if key else None
+        if stored is not None:
+            arrays, attrs = stored
+            self.rows, self.ids, self.duplicates = arrays["rows"], pd.Index(arrays["ids"]), attrs["duplicates"]
+        else:
+            if callable(lookup_ids):
+                lookup_ids = lookup_ids()
+            notna = lookup_ids.notna()
+            keep = (~lookup_ids.duplicated(keep='last') & notna).to_numpy()
+            self.rows = np.flatnonzero(keep)
+            self.ids = pd.Index(lookup_ids.to_numpy()[self.rows])
+            # Rows dropped because their ID appears again further down
+            self.duplicates = int(notna.sum()) - len(self.rows)
+            if key:
+                save_arrays(key, {"rows": self.rows, "ids": self.ids.to_numpy()}, {"duplicates": self.duplicates})
+        self._tokens = {}
+
+    @property
+    def nbytes(self):
+        # IDs and token vocabularies are object arrays; count their strings too
+        arrays = [self.rows] + [a for tokens in self._tokens.values() for a in tokens]
+        return int(self.ids.memory_usage(deep=True)) + sum(
+            int(pd.Index(a).memory_usage(deep=True)) if a.dtype == object else a.nbytes for a in arrays)
+
+    def positions(self, ids):
+        # Position of each ID in the index, -1 when it is not in the lookup table
+        return self.ids.get_indexer(ids)
+
+    def frame_rows(self, positions):
+        # Row of the lookup table for each index position, -1 where the ID was not found
+        if not len(self.rows):
+            return np.full(len(positions), -1)
+        return np.where(positions >= 0, self.rows[positions], -1)
+
+    def take(self, lookup_df, col, rows):
+        # Values of col at the given lookup rows (from frame_rows), missing where -1
+        return lookup_df[col].array.take(rows, allow_fill=True)
+
+    def tokens(self, lookup_df, col):
+        if col not in self._tokens:
+            key = result_key("tokens", self.key, col) if self.key else None
+            stored = load_arrays(key) if key else None
+            if stored is not None:
+                self._tokens[col] = tuple(stored[0][name] for name in _TOKEN_ARRAYS)
+            else:
+                values = lookup_df[col]
+                numeric = pd.api.types.is_numeric_dtype(values)
+                self._tokens[col] = tokenize_column(values.to_numpy()[self.rows], numeric=numeric)
+                if key:
+                    save_arrays(key, dict(zip(_TOKEN_ARRAYS, self._tokens[col])))
+        return self._tokens[col]
+
+# Bounded by entry count; one entry per uploaded lookup file and ID column
+_lookup_index_cache = LRUCache(int(os.getenv("LOOKUP_INDEX_CACHE_SIZE", "8")), sizeof=lambda index: 1)
+
+def get_lookup_index(lookup_key, lookup_df, id_col):
+    # Without lookup_df the ID column is parsed from the upload, and only if the index isn't stored
+    key = (lookup_key, id_col)
+    index = _lookup_index_cache.get(key)
+    if index is None:
+        if lookup_df is None:
+            lookup_ids = lambda: get_upload(lookup_key, [id_col])[id_col]
+        else:
+            lookup_ids = lookup_df[id_col]
+        index = _lookup_index_cache.put(key, LookupIndex(lookup_ids, result_key("lookup-index", lookup_key, id_col)))
+    return index
+  
+def score_values(series):
+    # Scores as float64 (unparseable values become NaN); None when nothing in a non-empty
+    # column parses, i.e. it is not a score column
+    scores = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+    if np.isnan(scores).all() and series.notna().any():
+        return None
+    return scores
+
+def round_scores(scores):
+    # Vectorized round(x, 3). np.round scales by 1000 first, which can push a value just
+    # below a ...5 tie upwards, so values near a tie are redone with round()
+    rounded = np.round(scores, 3)
+    with np.errstate(invalid='ignore'):
+        near = np.abs(np.abs(scores * 1000) % 1 - 0.5) < 1e-6
+    rounded[near] = [round(float(x), 3) for x in scores[near]]
+    return rounded
+
+def top_pairs(ids, scores, top_k=None, min_score=None):
+    # Sorted row positions of the pairs scoring at least min_score and among the top_k
+    # scores of their ID 1 (ties keep the earlier row; missing scores rank last)
+    keep = np.ones(len(scores), dtype=bool)
+    if min_score is not None:
+        with np.errstate(invalid='ignore'):
+            keep &= scores >= min_score
+    if top_k:
+        codes = pd.factorize(ids)[0]
+        order = np.lexsort((-scores, codes))
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        in_top = np.zeros(len(scores), dtype=bool)
+        in_top[order[rank < top_k]] = True
+        keep &= in_top
+    return np.flatnonzero(keep)
+
+# Upper bound on memory held by merged tables kept for paging and export (MB)
+TABLE_CACHE_MB = int(os.getenv("TABLE_CACHE_MB", "2048"))
+_table_cache = LRUCache(TABLE_CACHE_MB * 1024 * 1024)
+# Every cache of this process by name, for the memory figures served at /metrics
+CACHES = {"uploads": _upload_cache, "previews": _preview_cache, "lookup_indexes": _lookup_index_cache,
+          "tables": _table_cache}
+
+def result_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:40]
+
+# The result store: merged tables and their parts, parsed uploads, lookup token indexes and
+# exported workbooks, named by a hash of what they were computed from (upload content hashes and
+# column selections). Tables built in background job processes reach the web process through it,
+# and a later session with the same files and selections reads results back instead of
+# recomputing them. Files are Arrow IPC, memory-mapped when read
+RESULTS_DIR = os.getenv("RESULTS_DIR", os.path.join(tempfile.gettempdir(), "pairwise-results"))
+# Least recently used files are evicted past RESULTS_CACHE_MB; files unused for
+# RESULTS_MAX_AGE_HOURS are dropped too (0 keeps them until evicted)
+RESULTS_CACHE_MB = int(os.getenv("RESULTS_CACHE_MB", "10240"))
+RESULTS_MAX_AGE_HOURS = float(os.getenv("RESULTS_MAX_AGE_HOURS", "0"))
+# Stored frames are Arrow or pickle files (see save_frame); tables assembled from parts are JSON
+_FRAME_EXTENSIONS = ("arrow", "pkl")
+# Schema metadata keys holding a stored frame's attrs, and its Arrow-backed text columns, which
+# pyarrow would otherwise read back as Python strings
+_ATTRS_KEY = b"pairwise.attrs"
+_ARROW_TEXT_KEY = b"pairwise.arrow_text"
+
+def prune_results():
+    if RESULTS_MAX_AGE_HOURS > 0:
+        prune_dir(RESULTS_DIR, RESULTS_MAX_AGE_HOURS)
+    entries = []
+    for entry in os.scandir(RESULTS_DIR):
+        # Files still being written by another process
+        if entry.name.endswith(".tmp"):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    excess = sum(size for _, size, _ in entries) - RESULTS_CACHE_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if excess <= 0:
+            break
+        try:
+            os.remove(path)
+            excess -= size
+        except OSError:
+            pass
+
+def stored_path(key, extensions=_FRAME_EXTENSIONS):
+    # Path of the stored result for key, marked as just used so eviction keeps it; None if there
+    # is none
+    for ext in extensions:
+        path = os.path.join(RESULTS_DIR, f"{key}.{ext}")
+        try:
+            os.utime(path)
+        except OSError:
+            continue
+        return path
+    return None
+
+def write_result(key, ext, write):
+    # write(path) under a temporary name, then move it in place so readers never see a partial file
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    prune_results()
+    path = os.path.join(RESULTS_DIR, f"{key}.{ext}")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+    return path
+
+def _save_arrow(path, table, attrs, arrow_text=()):
+    import pyarrow as pa
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _ATTRS_KEY: json.dumps(attrs).encode(),
+                                           _ARROW_TEXT_KEY: json.dumps(list(arrow_text)).encode()})
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+def _load_arrow(path):
+    # Memory-mapped: pages are read as the data is used, and shared by every process reading it
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table, json.loads((table.schema.metadata or {}).get(_ATTRS_KEY, b"{}"))
+
+def save_frame(key, frame):
+    # Arrow when the frame converts to it; pickle for what Arrow can't hold (mixed-type object
+    # columns, non-string or repeated column names)
+    table = None
+    if importlib.util.find_spec('pyarrow') and frame.columns.is_unique and all(isinstance(c, str) for c in frame.columns):
+        import pyarrow as pa
+        try:
+            table = pa.Table.from_pandas(frame)
+        except pa.ArrowException:
+            pass
+    if table is None:
+        return write_result(key, "pkl", frame.to_pickle)
+    arrow_text = [col for col in frame.columns if frame[col].dtype == 'string[pyarrow]']
+    return write_result(key, "arrow", lambda path: _save_arrow(path, table, frame.attrs, arrow_text))
+
+def load_frame(path):
+    if not path.endswith(".arrow"):
+        return pd.read_pickle(path)
+    table, attrs = _load_arrow(path)
+    arrow_text = json.loads(table.schema.metadata.get(_ARROW_TEXT_KEY, b"[]"))
+    frame = table.drop_columns(arrow_text).to_pandas(split_blocks=True)
+    if arrow_text:
+        # Wraps the mapped Arrow data without converting it
+        frame = frame.assign(**{col: pd.arrays.ArrowStringArray(table[col]) for col in arrow_text})[table.column_names]
+    frame.attrs = attrs
+    return frame
+
+def stored_frame(key, compute):
+    # The frame stored under key, else compute() stored under it (unless empty, i.e. unreadable)
+    path = stored_path(key)
+    if path is not None:
+        return load_frame(path)
+    frame = compute()
+    if not frame.empty:
+        save_frame(key, frame)
+    return frame
+
+def save_arrays(key, arrays, attrs=None):
+    # 1-D arrays of any lengths in one Arrow file, each as a single-row list column. Skipped
+    # without pyarrow or for values Arrow can't hold: they only save recomputing the arrays
+    if not importlib.util.find_spec('pyarrow'):
+        return None
+    import pyarrow as pa
+    try:
+        table = pa.table({name: pa.LargeListArray.from_arrays(pa.array([0, len(values)], pa.int64()), pa.array(values))
+                          for name, values in arrays.items()})
+    except pa.ArrowException:
+        return None
+    return write_result(key, "arrow", lambda path: _save_arrow(path, table, attrs or {}))
+
+def load_arrays(key):
+    # (arrays, attrs) saved by save_arrays, or None. Numeric arrays are read-only views of the
+    # mapped file
+    path = stored_path(key, ("arrow",))
+    if path is None:
+        return None
+    table, attrs = _load_arrow(path)
+    return {name: table[name].chunk(0).values.to_numpy(zero_copy_only=False) for name in table.column_names}, attrs
+
+def compact_column(series):
+    # Smallest lossless representation: downcast numbers, dictionary-encode repetitive text
+    # (IDs, names, mostly-empty comparison results), Arrow-back the remaining text
+    if pd.api.types.is_integer_dtype(series.dtype) and isinstance(series.dtype, np.dtype):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(series.dtype) and series.dtype != np.float32:
+        narrow = series.astype(np.float32)
+        return narrow if narrow.astype(series.dtype).equals(series) else series
+    if isinstance(series.dtype, pd.StringDtype):
+        # Arrow-backed text (comparison results); categories stay object as for the text below
+        if series.nunique() > len(series) // 2:
+            return series
+        category = series.astype('category')
+        return pd.Series(pd.Categorical.from_codes(category.cat.codes, category.cat.categories.astype(object)), index=series.index, name=series.name)
+    if not pd.api.types.is_object_dtype(series.dtype) or pd.api.types.infer_dtype(series, skipna=True) != 'string':
+        return series
+    if series.nunique() <= len(series) // 2:
+        return series.astype('category')
+    if importlib.util.find_spec('pyarrow'):
+        return series.astype('string[pyarrow]')
+    return series
+
+def compact_frame(frame):
+    compact = pd.DataFrame({col: compact_column(frame[col]) for col in frame.columns}, index=frame.index)
+    compact.attrs = frame.attrs
+    return compact
+
+def store_table(key, frame):
+    save_frame(key, frame)
+    return _table_cache.put(key, frame)
+
+def store_table_parts(key, part_keys, columns):
+    # A table assembled from stored parts (see store_table); only the part keys and the
+    # column order are written, so a new column selection writes nothing to the store.
+    # Assembling copies the columns, and the copy is cached in _table_cache like any table
+    def write(path):
+        with open(path, "w") as f:
+            json.dump({"parts": part_keys, "columns": columns}, f)
+    write_result(key, "json", write)
+    # Keep the parts from being evicted while a table still uses them
+    for part_key in part_keys:
+        stored_path(part_key)
+    return get_table(key)
+
+def get_table(key):
+    if not key or not _RESULT_KEY.fullmatch(key):
+        return None
+    frame = _table_cache.get(key)
+    if frame is None:
+        path = stored_path(key, _FRAME_EXTENSIONS + ("json",))
+        if path is None:
+            return None
+        if not path.endswith(".json"):
+            frame = _table_cache.put(key, load_frame(path))
+        else:
+            with open(path) as f:
+                manifest = json.load(f)
+            parts = [get_table(part_key) for part_key in manifest["parts"]]
+            if any(part is None for part in parts):
+                return None
+            frame = pd.concat(parts, axis=1)[manifest["columns"]]
+            frame.attrs = {**parts[0].attrs, "base": manifest["parts"][0]}
+            frame = _table_cache.put(key, frame)
+    return frame
+
+# Result columns of each compared metadata column, and their highlight colors
+COMPARE_FILLS = ("D6F5D6", "FFFACD", "FFD9EC")
+
+def compare_column_names(col):
+    return (f"{col} | Shared in both", f"{col} | Unique to ID 1", f"{col} | Unique to ID 2")
+
+def pair_scores(pairs_df, sim_col, pos1, pos2, score_tokens=None, score_method=None):
+    # Score of each pair: the score_method similarity of a token index (see LookupIndex.tokens)
+    # when given, else the numeric sim_col of the pairs; None when there is neither
+    if score_tokens is not None:
+        return token_set_similarity(score_tokens, pos1, pos2, score_method)
+    return score_values(pairs_df[sim_col]) if sim_col and sim_col in pairs_df.columns else None
+
+def join_pairs(pairs_df, id1_col, id2_col, sim_col, index, lookup_df, name_col, usage_col, pos1, pos2, scores=None):
+    # The pairs as ID_1/ID_2 with the name and usage of both IDs and a Similarity/Score column.
+    # One pass over the pairs per side: each ID's lookup row (pos1/pos2, from index.positions)
+    # gives every requested attribute
+    merged = pairs_df.rename(columns={id1_col: "ID_1", id2_col: "ID_2"})
+    gathered = {}
+    for suffix, rows in (("_1", index.frame_rows(pos1)), ("_2", index.frame_rows(pos2))):
+        if name_col in lookup_df.columns:
+            gathered["Name" + suffix] = index.take(lookup_df, name_col, rows)
+        if usage_col and usage_col in lookup_df.columns:
+            gathered[usage_col + suffix] = index.take(lookup_df, usage_col, rows)
+    merged = merged.assign(**gathered)
+    if scores is not None:
+        merged["Similarity/Score"] = round_scores(scores)
+    elif sim_col and sim_col in pairs_df.columns:
+        # Not a numeric column; show it as is
+        merged["Similarity/Score"] = merged[sim_col]
+    return merged.reset_index(drop=True)
+
+def compare_column(index, lookup_df, col, pos1, pos2, pool=None):
+    # The shared / unique-to-1 / unique-to-2 columns of col for each pair
+    results = compare_token_sets(index.tokens(lookup_df, col), pos1, pos2, pool=pool)
+    return pd.DataFrame(dict(zip(compare_column_names(col), results)))
+
+def build_table(pairs_key, lookup_key, id1_col, id2_col, sim_col, lookup_id_col, name_col, usage_col, meta_col, compare_cols, display_cols, top_k=None, min_score=None, score_method=None, progress=None, workers=None):
+    # (key, table) of the merged table of two uploads, or (None, None) when they can't be read.
+    # progress((done, steps, message)) reports each step; workers defaults to BUILD_COMPARE_WORKERS.
+    # Raises ValueError for a similarity score_method without a metadata column
+    progress = progress or (lambda update: None)
+    steps = 2 + len(compare_cols or [])
+    # Scores computed from the metadata column's token sets instead of read from the pairs file
+    preview = upload_preview(lookup_key)
+    check_score_method(score_method, meta_col, preview.columns if not preview.empty else None)
+    score_col = meta_col if score_method in SIMILARITY_METRICS else None
+    score_by = (score_method, score_col) if score_col else None
+    # The joined pairs and each compare column's three result columns are stored as separate
+    # parts, so changing the compare or display selection only computes what is new
+    base_key = result_key("base", pairs_key, lookup_key, id1_col, id2_col, sim_col, lookup_id_col, name_col, usage_col, top_k, min_score, score_by)
+    phase("read")
+    merged = get_table(base_key)
+    # The lookup is only read for what isn't stored yet; a repeat build reads nothing but results
+    lookup_columns = [lookup_id_col, name_col, usage_col]
+    index = None
+    if merged is None:
+        pairs_df = get_upload(pairs_key, upload_columns(pairs_key, [id1_col, id2_col, sim_col]))
+        lookup_df = get_upload(lookup_key, upload_columns(lookup_key, lookup_columns))
+        if pairs_df.empty or lookup_df.empty:
+            return None, None
+        index = get_lookup_index(lookup_key, lookup_df, lookup_id_col)
+        pos1 = index.positions(pairs_df[id1_col])
+        pos2 = index.positions(pairs_df[id2_col])
+        score_tokens = None
+        if score_col:
+            phase("score")
+            progress((0, steps, f"Scoring {len(pairs_df):,} pairs by {SIMILARITY_METRICS[score_method]}"))
+            score_tokens = index.tokens(get_upload(lookup_key, upload_columns(lookup_key, [score_col])), score_col)
+        scores = pair_scores(pairs_df, sim_col, pos1, pos2, score_tokens, score_method)
+        if scores is not None and (top_k or min_score is not None):
+            # Drop pairs nobody will review before the join and comparisons
+            keep = top_pairs(pairs_df[id1_col], scores, top_k, min_score)
+            progress((0, steps, f"Kept {len(keep):,} of {len(pairs_df):,} pairs by score"))
+            pairs_df, scores, pos1, pos2 = pairs_df.iloc[keep], scores[keep], pos1[keep], pos2[keep]
+        progress((0, steps, f"Merging {len(pairs_df):,} pairs"))
+        phase("join")
+        merged = join_pairs(pairs_df, id1_col, id2_col, sim_col, index, lookup_df, name_col, usage_col, pos1, pos2, scores)
+        merged.attrs["lookup_duplicates"] = index.duplicates
+        # Lets the comparison card go back to the token index for a single row
+        merged.attrs["lookup"] = [lookup_key, lookup_id_col]
+        phase("store")
+        merged = store_table(base_key, compact_frame(merged))
+    progress((1, steps, f"Merged {len(merged):,} rows"))
+    parts = [merged]
+    part_keys = [base_key]
+    # One pool of comparison workers for all the columns of this build
+    with ComparePool(workers or BUILD_COMPARE_WORKERS) as pool:
+        for done, col in enumerate(compare_cols or [], 1):
+            col_key = result_key("compare", base_key, col)
+            phase("compare")
+            compared = get_table(col_key)
+            if compared is None:
+                col_df = get_upload(lookup_key, upload_columns(lookup_key, [col]))
+                if index is None and not col_df.empty:
+                    lookup_df = get_upload(lookup_key, upload_columns(lookup_key, lookup_columns))
+                    if not lookup_df.empty:
+                        index = get_lookup_index(lookup_key, lookup_df, lookup_id_col)
+                        pos1 = index.positions(merged["ID_1"])
+                        pos2 = index.positions(merged["ID_2"])
+                if col_df.empty or index is None:
+                    continue
+                compared = store_table(col_key, compact_frame(compare_column(index, col_df, col, pos1, pos2, pool)))
+            progress((1 + done, steps, f"Compared {col} ({done} of {len(compare_cols)} columns)"))
+            parts.append(compared)
+            part_keys.append(col_key)
+    available = set().union(*(part.columns for part in parts))
+    final_cols = [col for col in display_cols if col in available]
+    for col in compare_cols or []:
+        final_cols += [name for name in compare_column_names(col) if name in available and name not in final_cols]
+    key = result_key(pairs_key, lookup_key, id1_col, id2_col, sim_col, lookup_id_col, name_col, usage_col, top_k, min_score, score_by, compare_cols, final_cols)
+    phase("assemble")
+    table = store_table_parts(key, part_keys, final_cols)
+    count(rows=len(table))
+    return key, table
+
+def row_token_lists(frame, row_id, col):
+    # Shared / unique token lists of one table row, straight from the lookup's token index
+    # instead of re-splitting the joined strings; None if the table's source is unavailable
+    lookup_key, lookup_id_col = frame.attrs.get("lookup") or (None, None)
+    base = get_table(frame.attrs.get("base"))
+    col_df = get_upload(lookup_key, upload_columns(lookup_key, [col])) if lookup_key else pd.DataFrame()
+    if base is None or col_df.empty:
+        return None
+    index = get_lookup_index(lookup_key, None, lookup_id_col)
+    # Scalar reads, so a click costs the same whatever the table's length
+    pos1, pos2 = index.positions([base["ID_1"].iat[row_id], base["ID_2"].iat[row_id]])
+    return pair_token_lists(index.tokens(col_df, col), pos1, pos2)
+
+# Pairs generated per NumPy block when streaming the ID-list pair table
+PAIR_BLOCK_ROWS = int(os.getenv("PAIR_BLOCK_ROWS", "1000000"))
+# Excel caps a sheet at 1,048,576 rows (header included); larger outputs are split across sheets
+EXCEL_MAX_ROWS = 1048576
+MAX_EXCEL_PAIRS = int(os.getenv("MAX_EXCEL_PAIRS", "5000000"))
+PAIRS_FORMATS = {'xlsx': 'Excel (.xlsx)', 'csv.gz': 'Gzip CSV (.csv.gz)', 'parquet': 'Parquet (.parquet)'}
+# Rough output size relative to plain CSV, for the pre-run estimate
+PAIRS_SIZE_FACTORS = {'xlsx': 1.0, 'csv.gz': 0.15, 'parquet': 0.1}
+
+def pick_id_column(df):
+    return next((c for c in df.columns if 'id' in c.lower()), df.columns[0])
+
+def iter_pair_blocks(n, block_rows=None):
+    # All unordered index pairs i < j of n IDs, in row-major (triu) order, as blocks of
+    # whole rows holding about block_rows pairs each
+    block_rows = block_rows or PAIR_BLOCK_ROWS
+    counts = np.arange(n - 1, -1, -1, dtype=np.int64)
+    ends = np.cumsum(counts)
+    i0 = 0
+    while i0 < n - 1:
+        target = ends[i0] - counts[i0] + block_rows
+        i1 = min(max(int(np.searchsorted(ends, target, side='right')), i0 + 1), n)
+        rows = np.arange(i0, i1, dtype=np.int64)
+        c = counts[i0:i1]
+        i = np.repeat(rows, c)
+        j = np.arange(int(c.sum()), dtype=np.int64) - np.repeat(np.cumsum(c) - c, c) + np.repeat(rows + 1, c)
+        yield i, j
+        i0 = i1
+
+def _merge_pair_counts(keys, counts, new_keys):
+    # Fold new pair keys into sorted unique keys with occurrence counts
+    keys = np.concatenate([keys] + new_keys)
+    counts = np.concatenate([counts] + [np.ones(len(k), dtype=np.int64) for k in new_keys])
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    if len(keys) == 0:
+        return keys, counts
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(counts, starts)
+
+def _id_tokens(ids, index, lookup_df, cols):
+    # (token, member) occurrences of the ID list's tokens across cols, where member is the
+    # position in ids; tokens of different columns are kept apart. Also returns the token count
+    pos = index.positions(ids)
+    token_parts, member_parts, offset = [], [], 0
+    for col in cols:
+        codes, indptr, tokens, vocab = index.tokens(lookup_df, col)
+        n_vocab = max(len(vocab), 1)
+        values = np.where(pos >= 0, codes[pos], -1) if len(codes) else np.full(len(ids), -1)
+        members, tok = np.divmod(_pair_token_keys(values, indptr, tokens, n_vocab), n_vocab)
+        token_parts.append(tok + offset)
+        member_parts.append(members)
+        offset += n_vocab
+    tok = np.concatenate(token_parts) if token_parts else np.empty(0, dtype=np.int64)
+    members = np.concatenate(member_parts) if member_parts else np.empty(0, dtype=np.int64)
+    return tok, members, max(offset, 1)
+
+def blocked_pair_keys(ids, index, lookup_df, block_cols, min_shared=1, max_block_size=None, block_rows=None):
+    # Keys i * len(ids) + j (i < j, sorted) of the ID-list pairs that share at least min_shared
+    # tokens across block_cols. Uses an inverted index token -> IDs with parse_metadata_string
+    # semantics; tokens held by more than max_block_size IDs are skipped.
+    tok, members, _ = _id_tokens(ids, index, lookup_df, block_cols)
+    return _shared_token_pair_keys(tok, members, len(ids), min_shared, max_block_size, block_rows)
+
+def _shared_token_pair_keys(tok, members, n, min_shared=1, max_block_size=None, block_rows=None):
+    block_rows = block_rows or PAIR_BLOCK_ROWS
+    order = np.lexsort((members, tok))
+    tok, members = tok[order], members[order]
+    keys, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if len(tok) == 0:
+        return keys
+    # Each member pairs with the members after it in the same token block
+    starts = np.flatnonzero(np.r_[True, tok[1:] != tok[:-1]])
+    sizes = np.diff(np.r_[starts, len(tok)])
+    keep = sizes >= 2
+    if max_block_size:
+        keep &= sizes <= max_block_size
+    remaining = np.repeat(starts + sizes, sizes) - np.arange(len(tok)) - 1
+    remaining[~np.repeat(keep, sizes)] = 0
+    ends = np.cumsum(remaining)
+    pending, pending_rows, t0 = [], 0, 0
+    while t0 < len(tok):
+        target = ends[t0] - remaining[t0] + block_rows
+        t1 = min(max(int(np.searchsorted(ends, target, side='right')), t0 + 1), len(tok))
+        src = np.arange(t0, t1, dtype=np.int64)
+        r = remaining[t0:t1]
+        a = np.repeat(src, r)
+        b = np.arange(int(r.sum()), dtype=np.int64) - np.repeat(np.cumsum(r) - r, r) + np.repeat(src + 1, r)
+        pending.append(members[a] * n + members[b])
+        pending_rows += len(a)
+        # Compact once pending keys outgrow the accumulated ones, keeping memory near the candidate count
+        if pending_rows > max(8 * block_rows, len(keys)):
+            keys, counts = _merge_pair_counts(keys, counts, pending)
+            pending, pending_rows = [], 0
+        t0 = t1
+    keys, counts = _merge_pair_counts(keys, counts, pending)
+    return keys[counts >= max(min_shared or 1, 1)]
+
+# MinHash signature length for the generator's Jaccard blocking
+MINHASH_PERMUTATIONS = int(os.getenv("MINHASH_PERMUTATIONS", "128"))
+_MINHASH_PRIME = (1 << 31) - 1
+
+def minhash_signatures(indptr, tokens, num_perm=None, seed=0):
+    # (num_perm, rows) MinHash signatures of CSR token sets, from hashes (a * t + b) mod p;
+    # empty sets get p in every slot
+    num_perm = num_perm or MINHASH_PERMUTATIONS
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MINHASH_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MINHASH_PRIME, num_perm, dtype=np.uint64)
+    sizes = np.diff(indptr)
+    nonempty = sizes > 0
+    signatures = np.full((num_perm, len(sizes)), _MINHASH_PRIME, dtype=np.uint64)
+    if not nonempty.any():
+        return signatures
+    tokens = tokens.astype(np.uint64)
+    starts = indptr[:-1][nonempty]
+    # Hash a few permutations at a time to bound the (permutations x tokens) temporary
+    step = max(1, (1 << 24) // max(len(tokens), 1))
+    for p0 in range(0, num_perm, step):
+        hashed = (a[p0:p0 + step, None] * tokens[None, :] + b[p0:p0 + step, None]) % np.uint64(_MINHASH_PRIME)
+        signatures[p0:p0 + step, nonempty] = np.minimum.reduceat(hashed, starts, axis=1)
+    return signatures
+
+def lsh_bands(num_perm, threshold):
+    # (bands, rows per band) for LSH: the most rows per band (fewest false candidates) that still
+    # make a pair at exactly threshold a candidate with probability >= 0.95
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= 0.95:
+            return bands, rows
+    return num_perm, 1
+
+def minhash_pair_keys(ids, index, lookup_df, cols, threshold, num_perm=None, block_rows=None):
+    # Keys (as blocked_pair_keys) and exact Jaccard scores of the ID-list pairs whose token sets
+    # across cols have Jaccard >= threshold. Candidates come from LSH over MinHash signatures
+    # (IDs sharing any band), so most pairs are never looked at; candidates are then verified.
+    n = len(ids)
+    tok, members, n_vocab = _id_tokens(ids, index, lookup_df, cols)
+    order = np.lexsort((tok, members))
+    tok = tok[order]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(members, minlength=n), out=indptr[1:])
+    signatures = minhash_signatures(indptr, tok, num_perm)
+    bands, rows = lsh_bands(len(signatures), threshold)
+    holders = np.flatnonzero(np.diff(indptr) > 0)
+    # Every (band, bucket) is a token; IDs in the same bucket of any band become candidates
+    rng = np.random.default_rng(1)
+    band_tokens, band_members, offset = [], [], 0
+    for band in range(bands):
+        multipliers = rng.integers(1, 1 << 63, rows, dtype=np.uint64) | np.uint64(1)
+        bucket_hash = (signatures[band * rows:(band + 1) * rows, holders] * multipliers[:, None]).sum(axis=0)
+        buckets, uniques = pd.factorize(bucket_hash)
+        band_tokens.append(buckets + offset)
+        band_members.append(holders)
+        offset += len(uniques)
+    candidates = _shared_token_pair_keys(
+        np.concatenate(band_tokens) if band_tokens else np.empty(0, dtype=np.int64),
+        np.concatenate(band_members) if band_members else np.empty(0, dtype=np.int64),
+        n, block_rows=block_rows,
+    )
+    i, j = np.divmod(candidates, n)
+    scores = _set_similarity(i, j, indptr, tok, n_vocab)
+    keep = scores >= threshold
+    return candidates[keep], scores[keep]
+
+def iter_key_blocks(keys, n, block_rows=None, scores=None):
+    block_rows = block_rows or PAIR_BLOCK_ROWS
+    for start in range(0, len(keys), block_rows):
+        i, j = np.divmod(keys[start:start + block_rows], n)
+        yield (i, j) if scores is None else (i, j, scores[start:start + block_rows])
+
+def estimate_pairs_output(ids, n_pairs, fmt):
+    # Approximate output size in bytes, from the mean ID length
+    id_chars = float(pd.Series(ids).astype(str).str.len().mean()) if len(ids) else 0.0
+    return int(n_pairs * (2 * id_chars + 2) * PAIRS_SIZE_FACTORS.get(fmt, 1.0))
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f"{n:,.0f} {unit}" if unit == 'B' else f"{n:,.1f} {unit}"
+        n /= 1024
+
+def pairs_frame(ids, block):
+    # ID1/ID2 rows of a block of (i, j) index arrays, plus the scores when the block has them
+    frame = pd.DataFrame({'ID1': ids[block[0]], 'ID2': ids[block[1]]})
+    if len(block) > 2:
+        frame['Similarity/Score'] = round_scores(block[2])
+    return frame
+
+def pair_blocks(ids, keys=None, scores=None):
+    # Number of pairs and their blocks for write_pairs: every unordered pair of the IDs, or the
+    # pairs of blocked keys (with their scores, if any)
+    if keys is None:
+        return len(ids) * (len(ids) - 1) // 2, iter_pair_blocks(len(ids))
+    return len(keys), iter_key_blocks(keys, len(ids), scores=scores)
+
+def write_pairs(ids, blocks, path, fmt, progress=None, scored=False):
+    # Stream blocks of (i, j) or, with scored, (i, j, score) arrays into ID1/ID2(/Similarity/Score)
+    # rows; returns the number of pairs written. progress(written) is called after each block.
+    ids = np.asarray(ids)
+    columns = ['ID1', 'ID2'] + (['Similarity/Score'] if scored else [])
+    empty = pairs_frame(ids, (np.empty(0, dtype=np.int64),) * 2 + ((np.empty(0),) if scored else ()))
+    return write_frames(path, (pairs_frame(ids, block) for block in blocks), columns, fmt, 'Pairs', progress=progress, empty=empty)
+
+# Output formats by file extension
+OUTPUT_FORMATS = ('csv.gz', 'csv', 'parquet', 'xlsx')
+
+def output_format(path):
+    fmt = next((fmt for fmt in OUTPUT_FORMATS if path.lower().endswith('.' + fmt)), None)
+    if fmt is None:
+        raise ValueError(f"Unsupported output file: {path} (use {', '.join('.' + f for f in OUTPUT_FORMATS)})")
+    return fmt
+
+def write_frames(path, frames, columns, fmt, sheet_name='Sheet1', widths=None, fills=None, progress=None, empty=None):
+    # Stream DataFrames into one CSV ('csv' or gzipped 'csv.gz'), Parquet or Excel (see write_excel)
+    # file, keeping only `columns`; returns the number of rows written. progress(written) is
+    # called after each frame. `empty` sets the Parquet schema when there are no frames
+    written = 0
+    if fmt in ('csv', 'csv.gz'):
+        with (gzip.open(path, 'wt', newline='', compresslevel=3) if fmt == 'csv.gz' else open(path, 'w', newline='')) as f:
+            pd.DataFrame(columns=columns).to_csv(f, index=False)
+            for frame in frames:
+                frame[columns].to_csv(f, header=False, index=False)
+                written += len(frame)
+                if progress:
+                    progress(written)
+    elif fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for frame in frames:
+                table = pa.Table.from_pandas(frame[columns], preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                elif table.schema != writer.schema:
+                    # A frame whose column is all missing, say, infers a different type
+                    table = table.cast(writer.schema)
+                writer.write_table(table)
+                written += len(frame)
+                if progress:
+                    progress(written)
+            if writer is None:
+                empty = empty if empty is not None else pd.DataFrame(columns=columns)
+                pq.write_table(pa.Table.from_pandas(empty[columns], preserve_index=False), path)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        written = write_excel(path, frames, columns, sheet_name, widths, fills, progress)
+    return written
+
+# Rows converted to Python values per batch when writing Excel
+EXCEL_CHUNK_ROWS = 50000
+
+def excel_column_widths(df):
+    # Longest str() of the header and values per column plus padding, at least 12
+    widths = {}
+    for col in df.columns:
+        values = df[col]
+        longest = values.astype(str).where(values.notna(), "nan").str.len().max() if len(values) else 0
+        widths[col] = max(int(max(longest, len(str(col)))) + 2, 12)
+    return widths
+
+def write_excel(target, chunks, columns, sheet_name, widths=None, fills=None, progress=None):
+    # Single pass with a write-only workbook: bold header, fixed column widths, and fills as
+    # conditional formatting on non-blank cells. Rows past Excel's sheet limit continue on
+    # "<sheet_name> 2", ... Returns the number of data rows written; progress(written) is
+    # called every EXCEL_CHUNK_ROWS rows.
+    # Imported here, so only Excel output pays for loading openpyxl
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.styles import PatternFill, Font
+    from openpyxl.utils import get_column_letter
+    wb = Workbook(write_only=True)
+    header_font = Font(bold=True)
+    sheet_rows = EXCEL_MAX_ROWS - 1
+    ws, rows_in_sheet, written = None, 0, 0
+
+    def finish_sheet():
+        if ws is None or not fills or not rows_in_sheet:
+            return
+        for col, color in fills.items():
+            if col not in columns:
+                continue
+            letter = get_column_letter(columns.index(col) + 1)
+            fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+            ws.conditional_formatting.add(f"{letter}2:{letter}{rows_in_sheet + 1}",
+                                          FormulaRule(formula=[f'LEN(TRIM({letter}2))>0'], fill=fill))
+
+    def new_sheet():
+        sheet = wb.create_sheet(sheet_name if ws is None else f"{sheet_name} {written // sheet_rows + 1}")
+        for col, width in (widths or {}).items():
+            if col in columns:
+                sheet.column_dimensions[get_column_letter(columns.index(col) + 1)].width = width
+        header = []
+        for col in columns:
+            cell = WriteOnlyCell(sheet, value=col)
+            cell.font = header_font
+            header.append(cell)
+        sheet.append(header)
+        return sheet
+
+    for chunk in chunks:
+        for start in range(0, len(chunk), EXCEL_CHUNK_ROWS):
+            part = chunk.iloc[start:start + EXCEL_CHUNK_ROWS][columns].astype(object)
+            for row in part.astype(object).where(part.notna(), None).itertuples(index=False, name=None):
+                if ws is None or rows_in_sheet == sheet_rows:
+                    finish_sheet()
+                    ws, rows_in_sheet = new_sheet(), 0
+                ws.append(row)
+                rows_in_sheet += 1
+                written += 1
+            if progress:
+                progress(written)
+    if ws is None:
+        ws = new_sheet()
+    finish_sheet()
+    wb.save(target)
+    return written
+
+def export_table(path, df, compare_cols, progress=None, key=None):
+    # The merged table as one Excel sheet: widths from vectorized string lengths, and the
+    # shared/unique columns of each compare column colored. With a key the workbook is kept in
+    # the result store, and exporting the same table again copies it
+    if key:
+        stored = stored_path(key, ("xlsx",))
+        if stored is not None:
+            shutil.copyfile(stored, path)
+            if progress:
+                progress(len(df))
+            return len(df)
+        written = export_table(path, df, compare_cols, progress)
+        write_result(key, "xlsx", lambda tmp: shutil.copyfile(path, tmp))
+        return written
+    fills = {name: color for col in compare_cols or [] for name, color in zip(compare_column_names(col), COMPARE_FILLS)}
+    return write_excel(path, [df], list(df.columns), "Merged", excel_column_widths(df), fills, progress)
+
+def list_ids(df):
+    # Distinct IDs of an ID list, from its ID-like column
+    return df[pick_id_column(df)].dropna().unique()
+
+def check_blocking_method(method, threshold):
+    # MinHash blocking has no meaning without a threshold; never fall back to token blocking
+    if method == 'minhash' and (threshold is None or not 0 < threshold <= 1):
+        raise ValueError("Jaccard blocking needs a threshold between 0 and 1")
+
+def blocked_pairs(ids, index, lookup_df, block_cols, min_shared=1, max_block_size=None, method='tokens', threshold=None):
+    # (keys, scores) of the pairs to emit: pairs sharing tokens (scores None) or, for MinHash
+    # blocking, pairs with at least the threshold's Jaccard similarity
+    check_blocking_method(method, threshold)
+    if method == 'minhash':
+        return minhash_pair_keys(ids, index, lookup_df, block_cols, threshold)
+    return blocked_pair_keys(ids, index, lookup_df, block_cols, min_shared, max_block_size), None
+
+def blocked_pairs_bound(ids, index, lookup_df, block_cols, min_shared=1, max_block_size=None):
+    # Upper bound on the pairs blocked_pair_keys emits, from token block sizes alone: a pair
+    # sharing k tokens is counted k times in the sum of C(size, 2) over the blocks. Pairs with
+    # any Jaccard above 0 share a token, so it also bounds MinHash blocking (min_shared 1, no cap)
+    tok, _, n_tokens = _id_tokens(ids, index, lookup_df, block_cols)
+    sizes = np.bincount(tok, minlength=n_tokens)
+    if max_block_size:
+        sizes = sizes[sizes <= max_block_size]
+    n_pairs = int((sizes * (sizes - 1) // 2).sum()) // max(min_shared or 1, 1)
+    return min(n_pairs, len(ids) * (len(ids) - 1) // 2)
+
+def pair_inputs(id_list_key, block_key, block_id_col, block_cols):
+    # (ids, lookup_df, block_cols): IDs from the uploaded list and, when blocking is configured,
+    # the blocking metadata and the columns of it to block on (lookup_df None otherwise)
+    preview = upload_preview(id_list_key)
+    if preview.empty:
+        return None, None, []
+    ids = list_ids(get_upload(id_list_key, [pick_id_column(preview)]))
+    block_columns = upload_preview(block_key).columns
+    block_cols = [c for c in (block_cols or []) if c in block_columns]
+    if not block_cols or block_id_col not in block_columns:
+        return ids, None, []
+    return ids, get_upload(block_key, [block_id_col] + block_cols), block_cols
+
+def plan_pairs(id_list_key, block_key, block_id_col, block_cols, min_shared, max_block_size, method='tokens', threshold=None):
+    # IDs from the uploaded list and, when blocking is configured, the keys of the pairs to emit
+    # and (for MinHash/Jaccard blocking) their Jaccard scores
+    ids, lookup_df, block_cols = pair_inputs(id_list_key, block_key, block_id_col, block_cols)
+    if lookup_df is None:
+        return ids, None, None
+    index = get_lookup_index(block_key, lookup_df, block_id_col)
+    return (ids,) + tuple(blocked_pairs(ids, index, lookup_df, block_cols, min_shared, max_block_size, method, threshold))
+
+def estimate_pair_count(id_list_key, block_key, block_id_col, block_cols, min_shared, max_block_size, method='tokens', threshold=None):
+    # (ids, n_pairs, blocked) without generating any pairs: n_pairs is exact for all pairs and an
+    # upper bound (see blocked_pairs_bound) when blocking is configured
+    ids, lookup_df, block_cols = pair_inputs(id_list_key, block_key, block_id_col, block_cols)
+    if lookup_df is None:
+        return ids, (len(ids) * (len(ids) - 1) // 2 if ids is not None else 0), False
+    check_blocking_method(method, threshold)
+    if method == 'minhash':
+        min_shared, max_block_size = 1, None
+    index = get_lookup_index(block_key, lookup_df, block_id_col)
+    return ids, blocked_pairs_bound(ids, index, lookup_df, block_cols, min_shared, max_block_size), True
+
+# Pairs read, joined, compared and written at a time by compare_files; bounds its memory
+BATCH_CHUNK_ROWS = int(os.getenv("BATCH_CHUNK_ROWS", "1000000"))
+
+def iter_table_chunks(path, columns=None, chunk_rows=None):
+    # DataFrames of up to chunk_rows rows of a CSV (or .csv.gz), Parquet or Arrow file, read one
+    # at a time. Excel files hold at most a few sheets of rows and are read whole, then sliced
+    chunk_rows = chunk_rows or BATCH_CHUNK_ROWS
+    name = path.lower()
+    if name.endswith(('.csv', '.csv.gz')):
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows)
+    elif name.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    elif name.endswith(('.feather', '.arrow')):
+        import pyarrow as pa
+        # Memory-mapped, so only the chunk being converted is read
+        with pa.memory_map(path) as source:
+            try:
+                table = pa.ipc.open_file(source).read_all()
+            except pa.ArrowInvalid:
+                source.seek(0)
+                table = pa.ipc.open_stream(source).read_all()
+            if columns:
+                table = table.select(columns)
+            for start in range(0, table.num_rows, chunk_rows):
+                yield table.slice(start, chunk_rows).to_pandas()
+    else:
+        df = parse_contents(path, path, columns)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+
+def compare_files(pairs_path, lookup_path, output_path, id1_col, id2_col, lookup_id_col, sim_col=None, name_col=None,
+                  usage_col=None, meta_col=None, compare_cols=(), top_k=None, min_score=None, score_method=None,
+                  chunk_rows=None, workers=None, progress=None):
+    # The merged table of a pairs file and a lookup file, as the app builds it with every column
+    # shown, written to output_path (format by extension) chunk_rows pairs at a time: only the
+    # lookup table, its token indexes and one chunk are held. Comparisons are split across
+    # `workers` processes. progress(written) follows each chunk; returns the rows written
+    fmt = output_format(output_path)
+    compare_cols = list(compare_cols or [])
+    check_score_method(score_method, meta_col)
+    score_col = meta_col if score_method in SIMILARITY_METRICS else None
+    lookup_cols = list(dict.fromkeys(c for c in [lookup_id_col, name_col, usage_col, score_col] + compare_cols if c))
+    lookup_df = parse_contents(lookup_path, lookup_path, lookup_cols)
+    if lookup_df.empty:
+        raise ValueError(f"Could not read columns {', '.join(lookup_cols)} of {lookup_path}")
+    if usage_col and pd.api.types.is_integer_dtype(lookup_df[usage_col].dtype):
+        # A chunk with an unknown ID would turn the column to floats; every chunk needs one type
+        lookup_df[usage_col] = lookup_df[usage_col].astype('Int64')
+    index = LookupIndex(lookup_df[lookup_id_col])
+    score_tokens = index.tokens(lookup_df, score_col) if score_col else None
+    pair_cols = list(dict.fromkeys(c for c in (id1_col, id2_col, sim_col) if c))
+
+    def scored_chunks():
+        # Each chunk of pairs with the lookup positions of its IDs and its scores
+        for chunk in iter_table_chunks(pairs_path, pair_cols, chunk_rows):
+            chunk = chunk.reset_index(drop=True)
+            pos1, pos2 = index.positions(chunk[id1_col]), index.positions(chunk[id2_col])
+            yield chunk, pos1, pos2, pair_scores(chunk, sim_col, pos1, pos2, score_tokens, score_method)
+
+    keep = None
+    if top_k:
+        # An ID 1's top k pairs can be in any chunk, so a first pass ranks all the scores,
+        # holding an ID code and a score per pair
+        seen, codes, scores = pd.Index([], dtype=object), [], []
+        for chunk, pos1, pos2, chunk_scores in scored_chunks():
+            if chunk_scores is None:
+                break
+            ids = chunk[id1_col]
+            seen = seen.append(pd.Index(ids.dropna().unique()).difference(seen))
+            codes.append(seen.get_indexer(ids))
+            scores.append(chunk_scores)
+        else:
+            keep = np.zeros(sum(len(c) for c in codes), dtype=bool)
+            if codes:
+                keep[top_pairs(np.concatenate(codes), np.concatenate(scores), top_k, min_score)] = True
+
+    columns = ['ID_1', 'ID_2'] + (['Name_1', 'Name_2'] if name_col else []) + (
+        [f"{usage_col}_1", f"{usage_col}_2"] if usage_col else []) + (['Similarity/Score'] if sim_col or score_col else [])
+    columns += [name for col in compare_cols for name in compare_column_names(col)]
+    fills = {name: color for col in compare_cols for name, color in zip(compare_column_names(col), COMPARE_FILLS)}
+    widths = {}
+
+    def merged_chunks(pool):
+        offset = 0
+        for chunk, pos1, pos2, scores in scored_chunks():
+            rows = None
+            if keep is not None:
+                rows = np.flatnonzero(keep[offset:offset + len(chunk)])
+            elif scores is not None and min_score is not None:
+                rows = top_pairs(chunk[id1_col], scores, None, min_score)
+            offset += len(chunk)
+            if rows is not None:
+                chunk, pos1, pos2, scores = chunk.iloc[rows], pos1[rows], pos2[rows], scores[rows]
+            merged = join_pairs(chunk, id1_col, id2_col, sim_col, index, lookup_df, name_col, usage_col, pos1, pos2, scores)
+            merged = pd.concat([merged] + [compare_column(index, lookup_df, col, pos1, pos2, pool) for col in compare_cols], axis=1)
+            if fmt == 'xlsx' and not widths:
+                # Excel column widths are set before the first row is written; the first chunk
+                # stands in for the whole table
+                widths.update(excel_column_widths(merged[columns]))
+            yield merged
+
+    with ComparePool(workers) as pool:
+        return write_frames(output_path, merged_chunks(pool), columns, fmt, "Merged", widths, fills, progress)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pairwise comparison steps without the web app")
+    commands = parser.add_subparsers(dest='command', required=True)
+    compare = commands.add_parser('compare', help="merge a pairs file with ID metadata and compare metadata columns")
+    compare.add_argument('--pairs', required=True, help="pairs file (CSV, Excel, Parquet or Feather)")
+    compare.add_argument('--metadata', required=True, help="ID metadata file")
+    compare.add_argument('--id1', required=True, help="pairs column of ID 1")
+    compare.add_argument('--id2', required=True, help="pairs column of ID 2")
+    compare.add_argument('--score', help="pairs column with the similarity/score")
+    compare.add_argument('--id', required=True, help="metadata ID column")
+    compare.add_argument('--name', help="metadata name column")
+    compare.add_argument('--usage', help="metadata usage column")
+    compare.add_argument('--meta', help="metadata column to compare (unless --compare is given) and to score by --score-method")
+    compare.add_argument('--compare', nargs='*', help="metadata columns to compare for shared/unique values")
+    compare.add_argument('--score-method', choices=['column'] + list(SIMILARITY_METRICS), default='column',
+                         help="take scores from --score, or compute them from the --meta tokens")
+    compare.add_argument('--top-k', type=int, help="keep only the top k pairs per ID 1 by score")
+    compare.add_argument('--min-score', type=float, help="keep only pairs scoring at least this")
+    compare.add_argument('--chunk-rows', type=int, help=f"pairs processed at a time (default {BATCH_CHUNK_ROWS:,})")
+    compare.add_argument('--workers', type=int, help=f"processes comparing each chunk (default {COMPARE_WORKERS})")
+    compare.add_argument('--output', '-o', required=True, help="output file: .csv, .csv.gz, .parquet or .xlsx")
+    pairs = commands.add_parser('pairs', help="write the pairs of a list of IDs, optionally blocked on shared metadata")
+    pairs.add_argument('--ids', required=True, help="ID list file; IDs come from its ID-like column")
+    pairs.add_argument('--metadata', help="ID metadata file for blocking")
+    pairs.add_argument('--id', help="metadata ID column (default: the first ID-like column)")
+    pairs.add_argument('--block', nargs='*', default=[], help="metadata columns whose tokens pairs must share")
+    pairs.add_argument('--min-shared', type=int, default=1, help="tokens a pair must share")
+    pairs.add_argument('--max-block-size', type=int, help="skip tokens held by more IDs than this")
+    pairs.add_argument('--method', choices=['tokens', 'minhash'], default='tokens',
+                       help="pair on shared tokens, or on Jaccard similarity via MinHash LSH (adds a score column)")
+    pairs.add_argument('--threshold', type=float, default=0.5, help="Jaccard threshold for --method minhash")
+    pairs.add_argument('--output', '-o', required=True, help="output file: .csv, .csv.gz, .parquet or .xlsx")
+    args = parser.parse_args(argv)
+
+    def report(written):
+        print(f"Wrote {written:,} rows", file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    try:
+        if args.command == 'compare':
+            written = compare_files(
+                args.pairs, args.metadata, args.output, args.id1, args.id2, args.id, args.score, args.name, args.usage,
+                args.meta, args.compare if args.compare is not None else [args.meta] if args.meta else [],
+                args.top_k, args.min_score, args.score_method, args.chunk_rows, args.workers, report)
+        else:
+            fmt = output_format(args.output)
+            id_list = parse_contents(args.ids, args.ids)
+            if id_list.empty:
+                raise ValueError(f"Could not read {args.ids}")
+            ids, keys, scores = list_ids(id_list), None, None
+            if args.metadata and args.block:
+                id_col = args.id or pick_id_column(parse_contents(args.metadata, args.metadata, nrows=PREVIEW_ROWS))
+                lookup_df = parse_contents(args.metadata, args.metadata, [id_col] + args.block)
+                if lookup_df.empty:
+                    raise ValueError(f"Could not read columns {', '.join([id_col] + args.block)} of {args.metadata}")
+                keys, scores = blocked_pairs(ids, LookupIndex(lookup_df[id_col]), lookup_df, args.block,
+                                             args.min_shared, args.max_block_size, args.method, args.threshold)
+            n_pairs, blocks = pair_blocks(ids, keys, scores)
+            if fmt == 'xlsx' and n_pairs > MAX_EXCEL_PAIRS:
+                raise ValueError(f"{n_pairs:,} pairs is too many for Excel; write .csv.gz or .parquet")
+            written = write_pairs(ids, blocks, args.output, fmt, report, scored=scores is not None)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    print(f"Wrote {written:,} rows to {args.output} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
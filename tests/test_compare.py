@@ -0,0 +1,69 @@
+# The vectorized comparison must give exactly the strings of the original row-by-row loop
+# (set logic of parse_metadata_string, last lookup row per ID, "" for IDs not in the lookup)
+import os, sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import pipeline
+
+
+def reference(lookup_df, col, ids1, ids2):
+    # The comparison loop build_main_table ran before it was vectorized
+    col_is_numeric = pd.api.types.is_numeric_dtype(lookup_df[col])
+    id_to_attr = dict(zip(lookup_df["ID"], lookup_df[col]))
+    shared_list, uniq1_list, uniq2_list = [], [], []
+    for id1, id2 in zip(ids1, ids2):
+        meta1 = id_to_attr.get(id1, "")
+        meta2 = id_to_attr.get(id2, "")
+        if col_is_numeric:
+            set1 = set([str(meta1)]) if pd.notnull(meta1) and meta1 != "" else set()
+            set2 = set([str(meta2)]) if pd.notnull(meta2) and meta2 != "" else set()
+        else:
+            set1 = pipeline.parse_metadata_string(meta1)
+            set2 = pipeline.parse_metadata_string(meta2)
+        shared_list.append(", ".join(sorted(set1 & set2)))
+        uniq1_list.append(", ".join(sorted(set1 - set2)))
+        uniq2_list.append(", ".join(sorted(set2 - set1)))
+    return shared_list, uniq1_list, uniq2_list
+
+
+@pytest.fixture
+def lookup_df():
+    return pd.DataFrame({
+        # B is repeated (the last row wins); E has no values at all
+        "ID": ["A", "B", "C", "B", "D", "E"],
+        "Text": ["x, y,z", "old", " y , x ,, w", "z, y, b ", None, np.nan],
+        "Number": [1.5, 2.0, np.nan, 3.0, 1.5, np.nan],
+        "Integer": [1, 2, 3, 4, 5, 6],
+    })
+
+
+@pytest.fixture
+def pairs():
+    # Every ordering of the IDs plus IDs missing from the lookup table
+    ids = ["A", "B", "C", "D", "E", "missing"]
+    ids1, ids2 = zip(*[(a, b) for a in ids for b in ids])
+    return list(ids1) * 3, list(ids2) * 3
+
+
+@pytest.mark.parametrize("col", ["Text", "Number", "Integer"])
+@pytest.mark.parametrize("chunk_rows", [None, 7])
+def test_compare_token_sets_matches_reference(lookup_df, pairs, col, chunk_rows):
+    ids1, ids2 = pairs
+    index = pipeline.LookupIndex(lookup_df["ID"])
+    results = pipeline.compare_token_sets(index.tokens(lookup_df, col), index.positions(ids1), index.positions(ids2),
+                                          chunk_rows=chunk_rows, workers=1)
+    assert [r.tolist() for r in results] == list(reference(lookup_df, col, ids1, ids2))
+
+
+def test_sharded_compare_matches_reference(lookup_df, pairs, monkeypatch):
+    monkeypatch.setattr(pipeline, "COMPARE_SHARD_MIN_ROWS", 10)
+    ids1, ids2 = pairs
+    index = pipeline.LookupIndex(lookup_df["ID"])
+    results = pipeline.compare_token_sets(index.tokens(lookup_df, "Text"), index.positions(ids1), index.positions(ids2),
+                                          workers=2)
+    assert [r.tolist() for r in results] == list(reference(lookup_df, "Text", ids1, ids2))
@@ -0,0 +1,116 @@
+# Filtering and sorting of the result table, which replaces the DataTable's own filter_query/sort_by handling
+import os, sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import app
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        "Name": ["a && b", "Alpha", "alpha", "", None, "10"],
+        "Score": [0.5, 1.0, np.nan, 2.0, 10.0, 3.0],
+        "Code": ["10", "9", "100", None, "", "9.5"],
+        "Group": pd.Categorical(["b", "a", "c", "a", None, "b"], categories=["c", "b", "a"]),
+    })
+
+
+def rows(frame, query):
+    return np.flatnonzero(app.filter_mask(frame, query)).tolist()
+
+
+def test_split_filter_query_keeps_quoted_separators():
+    assert app.split_filter_query('{Name} = "a && b" && {Score} > 1') == ['{Name} = "a && b"', '{Score} > 1']
+    assert app.split_filter_query("{Name} = 'x \\' && y'") == ["{Name} = 'x \\' && y'"]
+    assert app.split_filter_query(" && ") == []
+
+
+def test_quoted_value_containing_separator(frame):
+    assert rows(frame, '{Name} = "a && b"') == [0]
+    assert rows(frame, '{Name} contains "&&" && {Score} < 1') == [0]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("{Name} = alpha", [2]),
+    ("{Name} seq alpha", [2]),
+    ("{Name} ieq alpha", [1, 2]),
+    ("{Name} icontains ALP", [1, 2]),
+    ("{Name} scontains ALP", []),
+    ("{Name} ine alpha", [0, 3, 4, 5]),
+])
+def test_case_prefixes(frame, query, expected):
+    assert rows(frame, query) == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("{Name} is blank", [3, 4]),
+    ("{Code} is blank", [3, 4]),
+    ("{Score} is blank", [2]),
+    ("{Code} is num", [0, 1, 2, 5]),
+    ("{Name} is num", [5]),
+    ("{Name} is str", [0, 1, 2, 3, 5]),
+])
+def test_is_operators(frame, query, expected):
+    assert rows(frame, query) == expected
+
+
+def test_numeric_and_text_equality(frame):
+    # Numbers compare numerically on numeric columns and as text elsewhere
+    assert rows(frame, "{Score} = 10") == [4]
+    assert rows(frame, "{Score} = 1") == [1]
+    assert rows(frame, "{Code} = 9") == [1]
+    assert rows(frame, "{Code} = 9.0") == []
+    assert rows(frame, '{Score} = "10"') == []
+    assert rows(frame, "{Score} >= 2") == [3, 4, 5]
+    # Missing values never match a comparison, except !=
+    assert rows(frame, "{Score} != 1") == [0, 2, 3, 4, 5]
+
+
+def test_unknown_columns_and_operators_are_ignored(frame):
+    assert rows(frame, "{Missing} = 1") == list(range(len(frame)))
+    assert rows(frame, "{Missing} = 1 && {Score} > 2") == [4, 5]
+    assert rows(frame, "{Score} regex 1") == list(range(len(frame)))
+    assert rows(frame, "not a filter") == list(range(len(frame)))
+    assert rows(frame, None) == list(range(len(frame)))
+
+
+@pytest.fixture(autouse=True)
+def view_cache(monkeypatch):
+    # Views are cached by table key; every test starts from an empty cache
+    monkeypatch.setattr(app, "_view_cache", app.LRUCache(32, sizeof=lambda rows: 1))
+
+
+def view(frame, sort_by, query=""):
+    return app.table_view("test", frame, sort_by, query).tolist()
+
+
+def test_sort_numbers_stored_as_text(frame):
+    # Blank values go last in either direction
+    assert view(frame, [{"column_id": "Code", "direction": "asc"}]) == [1, 5, 0, 2, 3, 4]
+    assert view(frame, [{"column_id": "Code", "direction": "desc"}]) == [2, 0, 5, 1, 3, 4]
+
+
+def test_sort_mixed_text(frame):
+    assert view(frame, [{"column_id": "Name", "direction": "asc"}]) == [3, 5, 1, 0, 2, 4]
+
+
+def test_sort_categorical_uses_category_order(frame):
+    assert view(frame, [{"column_id": "Group", "direction": "asc"}]) == [2, 0, 5, 1, 3, 4]
+    assert view(frame, [{"column_id": "Group", "direction": "desc"},
+                        {"column_id": "Score", "direction": "desc"}]) == [3, 1, 5, 0, 2, 4]
+
+
+def test_sort_after_filter_and_unknown_sort_column(frame):
+    assert view(frame, [{"column_id": "Score", "direction": "desc"}], "{Score} < 5") == [5, 3, 1, 0]
+    assert view(frame, [{"column_id": "Missing", "direction": "asc"}], "{Score} < 5") == [0, 1, 3, 5]
+
+
+def test_view_cache_is_keyed_on_query(frame):
+    first = app.table_view("test", frame, None, "{Score} > 1").tolist()
+    second = app.table_view("test", frame, None, "{Score} < 1").tolist()
+    assert (first, second) == ([3, 4, 5], [0])